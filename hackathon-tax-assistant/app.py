@@ -1,36 +1,210 @@
-import os, pickle, numpy as np
-from fastapi import FastAPI
-from pydantic import BaseModel
+import os, re, math, json, pickle, asyncio, hashlib, logging, numpy as np
+import msgspec
+import orjson
+from cachetools import LRUCache, TTLCache
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
-from typing import List
+from typing import List, Union
+from pathlib import Path
 
-from azure_openai import create_client
+from azure_openai import create_async_client
+from quantize import quantize_int8
+
+try:
+    import simsimd  # optional SIMD similarity kernels; NumPy GEMV fallback otherwise
+    _SIMD = True
+except ImportError:
+    _SIMD = False
+
+try:
+    import ahocorasick  # optional (pyahocorasick); compiled-regex fallback otherwise
+except ImportError:
+    ahocorasick = None
 
 load_dotenv()
 
 CHAT_MODEL = os.environ.get("CHAT_MODEL", "phi-3-mini")  # deployment or global model name
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
 TOP_K = int(os.environ.get("TOP_K", "4"))
+# Concurrent /chat queries arriving within EMBED_BATCH_WAIT_MS share one embeddings request.
+EMBED_BATCH_MAX = int(os.environ.get("EMBED_BATCH_MAX", "16"))
+EMBED_BATCH_WAIT_MS = float(os.environ.get("EMBED_BATCH_WAIT_MS", "20"))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+CHAT_BATCH_MAX = int(os.environ.get("CHAT_BATCH_MAX", "32"))  # questions per /chat/batch request
+
+# Repeated questions skip the embeddings call; identical (question, retrieved chunks, history
+# tail) combinations skip the LLM call for RESPONSE_CACHE_TTL seconds.
+_EMBED_CACHE = LRUCache(maxsize=4096)
+_RESPONSE_CACHE = TTLCache(maxsize=1024, ttl=RESPONSE_CACHE_TTL)
+
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+STORE_DIR = Path(os.environ.get("STORE_DIR", "vector_store"))
+
+# USE_INT8=1 scores against int8 codes with simsimd's int8 kernels (4x less memory traffic than
+# float32). NumPy has no BLAS int8 product, so without simsimd the float32 path is used instead.
+USE_INT8 = os.environ.get("USE_INT8", "").lower() in {"1", "true", "yes"}
+if USE_INT8 and not _SIMD:
+    logging.getLogger(__name__).warning("USE_INT8 needs simsimd (pip install simsimd); scoring with float32")
+    USE_INT8 = False
+
+_META_FIELDS = ("id", "text", "source", "chunk_index")
+
+def _columns(records) -> tuple:
+    """Split per-chunk records into parallel lists, one per _META_FIELDS entry."""
+    return tuple([r.get(f) for r in records] for f in _META_FIELDS)
+
+def _load_store():
+    """Return (meta columns, float32 matrix, int8 codes, int8 scales) for the vector store.
+
+    The layout written by ingest.py (emb.npy + meta.jsonl) is memory-mapped read-only, so startup
+    does not copy the matrix and forked workers share its pages. Rows are already unit-norm.
+    A legacy embeddings.pkl store is stacked and normalized in memory instead. Codes and
+    scales are None unless USE_INT8 is set; stores written before emb_q.npy existed are
+    quantized at load.
+    """
+    meta_path = STORE_DIR / "meta.jsonl"
+    if meta_path.exists():
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = _columns([json.loads(line) for line in f])
+        mat = np.load(STORE_DIR / "emb.npy", mmap_mode="r")
+        if not USE_INT8:
+            return meta, mat, None, None
+        if not (STORE_DIR / "emb_q.npy").exists() or not (STORE_DIR / "emb_scales.npy").exists():
+            return (meta, mat, *quantize_int8(mat))
+        return meta, mat, np.load(STORE_DIR / "emb_q.npy", mmap_mode="r"), np.load(STORE_DIR / "emb_scales.npy")
+    with open(STORE_DIR / "embeddings.pkl", "rb") as f:
+        records = pickle.load(f)
+    meta = _columns(records)
+    mat = np.vstack([r["embedding"] for r in records]).astype(np.float32, copy=False)
+    del records  # drop the per-record embedding copies; only the matrix is kept
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9
+    if not USE_INT8:
+        return meta, mat, None, None
+    return (meta, mat, *quantize_int8(mat))
+
+# KB_MAT is an (N, D) matrix with unit-norm rows so a query is scored against the whole KB with
+# a single matrix-vector product. Chunk metadata is stored column-wise in lists index-aligned
+# with its rows; record dicts are only built for the k hits a query returns. Everything is
+# filled by load_store() from the startup handler, i.e. after uvicorn has forked its workers,
+# so each worker maps the store itself rather than inheriting a copy made in the parent.
+KB_IDS: List[str] = []
+KB_TEXTS: List[str] = []
+KB_SOURCES: List[str] = []
+KB_CHUNK_IDX: List[int] = []
+KB_MAT = KB_Q = KB_SCALES = None
+
+def load_store():
+    global KB_IDS, KB_TEXTS, KB_SOURCES, KB_CHUNK_IDX, KB_MAT, KB_Q, KB_SCALES
+    if KB_MAT is None:
+        (KB_IDS, KB_TEXTS, KB_SOURCES, KB_CHUNK_IDX), KB_MAT, KB_Q, KB_SCALES = _load_store()
+
+client = create_async_client()
+
+async def embed_many(texts: List[str]) -> List[np.ndarray]:
+    """Embed several queries with one request; output order matches input order."""
+    r = await client.embeddings.create(model=EMBED_MODEL, input=texts)
+    return [np.array(d.embedding, dtype="float32") for d in sorted(r.data, key=lambda d: d.index)]
+
+class EmbeddingBatcher:
+    """Coalesces concurrent query embeddings into multi-input embeddings requests.
+
+    Callers await embed(); a background task collects queued queries until max_batch items are
+    waiting or max_wait_ms has passed since the first one, then sends them as a single request
+    and resolves each caller's future with its own vector.
+    """
+
+    def __init__(self, max_batch: int = EMBED_BATCH_MAX, max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._inflight = set()  # strong refs so dispatch tasks aren't garbage collected
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
 
-with open("vector_store/embeddings.pkl", "rb") as f:
-    KB = pickle.load(f)
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
-client = create_client()
+    async def embed(self, text: str) -> np.ndarray:
+        if self._task is None:
+            self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
 
-def embed(q: str):
-    r = client.embeddings.create(model=EMBED_MODEL, input=q)
-    return np.array(r.data[0].embedding, dtype="float32")
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without blocking collection of the next batch.
+            task = asyncio.create_task(self._dispatch(items))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
 
-def cosine(a, b):
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9))
+    async def _dispatch(self, items):
+        try:
+            vectors = await embed_many([text for text, _ in items])
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), vec in zip(items, vectors):
+            if not fut.done():
+                fut.set_result(vec)
+
+embed_batcher = EmbeddingBatcher()
+
+def search(qv: np.ndarray, k=TOP_K):
+    """Return the k KB records most similar to the query vector qv.
+
+    KB rows are unit-norm, so a plain dot product ranks exactly like cosine similarity
+    (the query's own norm is a constant factor); no per-row normalization is needed."""
+    # Lower distance == more similar on every path.
+    if USE_INT8:
+        qq, _ = quantize_int8(qv)  # USE_INT8 implies _SIMD
+        dists = -(np.asarray(simsimd.cdist(qq.reshape(1, -1), KB_Q, metric="dot")).ravel() * KB_SCALES)
+    elif _SIMD:
+        dists = -np.asarray(simsimd.cdist(qv.reshape(1, -1), KB_MAT, metric="dot")).ravel()
+    else:
+        dists = -(KB_MAT @ qv)
+    return [
+        {"id": KB_IDS[i], "text": KB_TEXTS[i], "source": KB_SOURCES[i], "chunk_index": KB_CHUNK_IDX[i]}
+        for i in _top_k(dists, k)
+    ]
+
+def _top_k(dists: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k smallest distances, ascending: O(N + k log k) instead of a full sort."""
+    k = min(k, dists.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(dists, k - 1)[:k]
+    return top[np.argsort(dists[top])]
 
-def retrieve(query: str, k=TOP_K):
-    qv = embed(query)
-    scored = []
-    for rec in KB:
-        scored.append((cosine(qv, rec["embedding"]), rec))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [r for _, r in scored[:k]]
+async def retrieve(query: str, k=TOP_K):
+    key = _sha1(query)
+    qv = _EMBED_CACHE.get(key)
+    if qv is None:
+        qv = await embed_batcher.embed(query)
+        qv *= 1.0 / (math.sqrt(float(np.vdot(qv, qv))) + 1e-9)  # normalize once, then cache
+        _EMBED_CACHE[key] = qv
+    return search(qv, k)
 
 def _load_system_prompt():
     """Load the expanded system prompt from markdown; fallback to minimal prompt if unavailable.
@@ -78,20 +252,120 @@ def _load_system_prompt():
         return base_fallback
 
 SYSTEM_PROMPT = _load_system_prompt()
+# Built once and shared by reference across requests.
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct):
     question: str
     history: List[dict] = []
     context_data: dict = {}  # For additional form/salary data
 
-class ChatResponse(BaseModel):
+class ChatResponse(msgspec.Struct):
     answer: str
     sources: List[str]
     regime_comparison: dict = {}  # Old vs New regime analysis
     optimization_suggestions: List[dict] = []  # Tax saving opportunities
     next_steps: List[str] = []  # Recommended actions
 
-app = FastAPI(title="Hackathon Tax Assistant")
+class ChatBatchRequest(msgspec.Struct):
+    messages: List[ChatRequest]
+
+class ChatError(msgspec.Struct):
+    error: str  # short label, e.g. the exception type
+    message: str
+
+class ChatBatchResponse(msgspec.Struct):
+    responses: List[Union[ChatResponse, ChatError]]
+
+# Request bodies are decoded and validated by msgspec directly from the raw bytes rather than
+# through FastAPI's pydantic layer; responses are encoded the same way.
+_CHAT_REQUEST_DECODER = msgspec.json.Decoder(ChatRequest)
+_CHAT_BATCH_DECODER = msgspec.json.Decoder(ChatBatchRequest)
+_JSON_ENCODER = msgspec.json.Encoder()
+
+async def _read_chat_request(request: Request) -> ChatRequest:
+    try:
+        return _CHAT_REQUEST_DECODER.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+app = FastAPI(title="Hackathon Tax Assistant", default_response_class=ORJSONResponse)
+
+@app.on_event("startup")
+async def _startup():
+    load_store()
+    embed_batcher.start()
+
+@app.on_event("shutdown")
+async def _stop_batcher():
+    await embed_batcher.stop()
+
+async def complete_chat(messages: List[dict], max_tokens: int = 1200) -> str:
+    """Call chat.completions, falling back to the responses API (global endpoint style)."""
+    try:
+        resp = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            temperature=0.1,
+            messages=messages,
+            max_tokens=max_tokens
+        )
+        return resp.choices[0].message.content
+    except Exception:
+        r2 = await client.responses.create(
+            model=CHAT_MODEL,
+            input=messages,
+            temperature=0.1,
+            max_output_tokens=max_tokens,
+        )
+        return r2.output_text
+
+async def stream_chat(messages: List[dict], max_tokens: int = 1200):
+    """Yield answer text deltas from a streamed chat.completions call (non-streamed fallback)."""
+    try:
+        stream = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            temperature=0.1,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+    except Exception:
+        yield await complete_chat(messages, max_tokens)
+        return
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def _sse(event: str, data) -> str:
+    # JSON-encode every payload so newlines inside answer text cannot break SSE framing.
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+# Scenario keyword -> tags it triggers. Matched in a single pass over the lowercased question.
+_SCENARIO_KEYWORDS = {
+    "salary": ("salary",),
+    "income": ("salary",),
+    "form 16": ("salary", "form16"),
+    "tax liability": ("salary",),
+    "investment": ("investment",),
+    "80c": ("investment",),
+    "tax saving": ("investment",),
+    "deduction": ("investment",),
+}
+
+if ahocorasick is not None:
+    _SCENARIO_AC = ahocorasick.Automaton()
+    for _kw, _tags in _SCENARIO_KEYWORDS.items():
+        _SCENARIO_AC.add_word(_kw, _tags)
+    _SCENARIO_AC.make_automaton()
+
+    def _scenario_tags(text: str) -> set:
+        return {tag for _, tags in _SCENARIO_AC.iter(text) for tag in tags}
+else:
+    # Lookahead so overlapping keywords are all reported, like the automaton does.
+    _SCENARIO_RE = re.compile("(?=(" + "|".join(map(re.escape, _SCENARIO_KEYWORDS)) + "))")
+
+    def _scenario_tags(text: str) -> set:
+        return {tag for m in _SCENARIO_RE.finditer(text) for tag in _SCENARIO_KEYWORDS[m.group(1)]}
 
 def analyze_tax_scenario(question: str, context_text: str):
     """Analyze the question and context to extract tax optimization opportunities"""
@@ -100,10 +374,10 @@ def analyze_tax_scenario(question: str, context_text: str):
     next_steps = []
     
     # Check for common tax scenarios
-    question_lower = question.lower()
+    tags = _scenario_tags(question.lower())
     
     # Salary/income analysis scenario
-    if any(keyword in question_lower for keyword in ['salary', 'income', 'form 16', 'tax liability']):
+    if "salary" in tags:
         optimization_suggestions.extend([
             {"strategy": "Maximize 80C deductions", "potential_saving": "Up to ₹46,500", "priority": "HIGH"},
             {"strategy": "Optimize health insurance", "potential_saving": "Up to ₹23,250", "priority": "HIGH"},
@@ -116,7 +390,7 @@ def analyze_tax_scenario(question: str, context_text: str):
         ])
     
     # Investment planning scenario
-    if any(keyword in question_lower for keyword in ['investment', '80c', 'tax saving', 'deduction']):
+    if "investment" in tags:
         optimization_suggestions.extend([
             {"strategy": "ELSS mutual funds", "benefit": "Growth potential + 3-year lock-in", "priority": "HIGH"},
             {"strategy": "PPF contribution", "benefit": "EEE benefit + 15-year wealth building", "priority": "HIGH"},
@@ -129,7 +403,7 @@ def analyze_tax_scenario(question: str, context_text: str):
         ])
     
     # Form 16 analysis scenario
-    if 'form 16' in question_lower:
+    if "form16" in tags:
         next_steps.extend([
             "Verify TDS details against Form 26AS",
             "Check HRA exemption optimization",
@@ -137,9 +411,14 @@ def analyze_tax_scenario(question: str, context_text: str):
             "Compare tax liability under both regimes"
         ])
     
-@app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    hits = retrieve(req.question)
+    return optimization_suggestions, regime_comparison, next_steps
+
+def _response_cache_key(req: ChatRequest, hits: List[dict]) -> str:
+    history_sig = json.dumps(req.history[-5:], sort_keys=True, ensure_ascii=False)
+    return _sha1(req.question + "|" + "|".join(h["id"] for h in hits) + "|" + history_sig)
+
+def _build_messages(req: ChatRequest, hits: List[dict]):
+    """Return (messages, context_text) for the question and its retrieved chunks."""
     context_blocks = []
     for i, h in enumerate(hits):
         context_blocks.append(f"[Chunk {i}]\\n{h['text']}")
@@ -161,77 +440,95 @@ Instructions:
 
 Answer:"""
     
-    messages = [{"role":"system","content":SYSTEM_PROMPT}]
-    for h in req.history[-5:]:
-        messages.append(h)
-    messages.append({"role":"user","content":user_content})
+    messages = [_SYSTEM_MSG, *req.history[-5:], {"role":"user","content":user_content}]
+    return messages, context_text
+
+async def _answer(req: ChatRequest) -> ChatResponse:
+    hits = await retrieve(req.question)
+    cache_key = _response_cache_key(req, hits)
+    cached = _RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    messages, context_text = _build_messages(req, hits)
     
     # Generate enhanced analysis
     optimization_suggestions, regime_comparison, next_steps = analyze_tax_scenario(req.question, context_text)
     
     # Get AI response
-    answer = None
-    try:
-        resp = client.chat.completions.create(
-            model=CHAT_MODEL,
-            temperature=0.1,
-            messages=messages,
-            max_tokens=1200  # Increased for comprehensive responses
-        )
-        answer = resp.choices[0].message.content
-    except Exception as e:
-        try:
-            r2 = client.responses.create(
-                model=CHAT_MODEL,
-                input=messages,
-                temperature=0.1,
-                max_output_tokens=1200,
-            )
-            answer = r2.output_text
-        except Exception as e2:
-            raise e2
+    answer = await complete_chat(messages, 1200)
     
-    return ChatResponse(
+    response = ChatResponse(
         answer=answer, 
         sources=[f"Chunk {i}" for i,_ in enumerate(hits)],
         regime_comparison=regime_comparison,
         optimization_suggestions=optimization_suggestions,
         next_steps=next_steps
     )
-    hits = retrieve(req.question)
-    context_blocks = []
-    for i, h in enumerate(hits):
-        context_blocks.append(f"[Chunk {i}]\\n{h['text']}")
-    context_text = "\n\n".join(context_blocks)
-    user_content = f"Question: {req.question}\n\nContext:\n{context_text}\n\nAnswer:"
-    messages = [{"role":"system","content":SYSTEM_PROMPT}]
-    for h in req.history[-5:]:
-        messages.append(h)
-    messages.append({"role":"user","content":user_content})
-    # Use responses API if global, else chat.completions for azure legacy; attempt both.
-    answer = None
+    _RESPONSE_CACHE[cache_key] = response
+    return response
+
+@app.post("/chat")
+async def chat(request: Request):
+    req = await _read_chat_request(request)
+    return Response(_JSON_ENCODER.encode(await _answer(req)), media_type="application/json")
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request):
+    """Answer several /chat bodies in one round trip: {"messages": [...]} -> {"responses": [...]},
+    in order. Questions are answered concurrently, so their embeddings share one batched call."""
     try:
-        resp = client.chat.completions.create(
-            model=CHAT_MODEL,
-            temperature=0.1,
-            messages=messages,
-            max_tokens=700
-        )
-        answer = resp.choices[0].message.content
-    except Exception as e:
-        # Fallback to new responses API (global endpoint style)
-        try:
-            r2 = client.responses.create(
-                model=CHAT_MODEL,
-                input=messages,
-                temperature=0.1,
-                max_output_tokens=700,
-            )
-            answer = r2.output_text
-        except Exception as e2:
-            raise e2
-    return ChatResponse(answer=answer, sources=[f"Chunk {i}" for i,_ in enumerate(hits)])
+        batch = _CHAT_BATCH_DECODER.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if len(batch.messages) > CHAT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX} messages per batch")
+    # A failed question gets an error entry in its slot; the other answers are still returned
+    results = await asyncio.gather(*(_answer(req) for req in batch.messages), return_exceptions=True)
+    responses = [
+        ChatError(error=type(r).__name__, message=str(r)) if isinstance(r, BaseException) else r
+        for r in results
+    ]
+    return Response(_JSON_ENCODER.encode(ChatBatchResponse(responses=responses)), media_type="application/json")
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Same as /chat, streamed as SSE: one `meta` event (every ChatResponse field except
+    answer), then `token` events carrying answer text deltas, then `done`."""
+    req = await _read_chat_request(request)
+    hits = await retrieve(req.question)
+    cache_key = _response_cache_key(req, hits)
+    cached = _RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        meta = {
+            "sources": cached.sources,
+            "regime_comparison": cached.regime_comparison,
+            "optimization_suggestions": cached.optimization_suggestions,
+            "next_steps": cached.next_steps,
+        }
+    else:
+        messages, context_text = _build_messages(req, hits)
+        optimization_suggestions, regime_comparison, next_steps = analyze_tax_scenario(req.question, context_text)
+        meta = {
+            "sources": [f"Chunk {i}" for i,_ in enumerate(hits)],
+            "regime_comparison": regime_comparison,
+            "optimization_suggestions": optimization_suggestions,
+            "next_steps": next_steps,
+        }
+
+    async def events():
+        yield _sse("meta", meta)
+        if cached is not None:
+            yield _sse("token", cached.answer)
+        else:
+            parts = []
+            async for delta in stream_chat(messages, 1200):
+                parts.append(delta)
+                yield _sse("token", delta)
+            _RESPONSE_CACHE[cache_key] = ChatResponse(answer="".join(parts), **meta)
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/healthz")
 def health():
-    return {"status": "ok", "chunks": len(KB)}
\ No newline at end of file
+    return {"status": "ok", "chunks": len(KB_IDS)}
\ No newline at end of file
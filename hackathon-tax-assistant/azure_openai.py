@@ -13,13 +13,13 @@ Environment Variable Modes:
 
 Set USE_GLOBAL_OPENAI=1 to force global endpoint path if both are present.
 
-The rest of the code can call create_client() and pass a 'model' string (either deployment
-name for Azure resource or model name for global inference).
+The rest of the code can call create_client() (or create_async_client() from async code) and
+pass a 'model' string (either deployment name for Azure resource or model name for global inference).
 """
 
 from __future__ import annotations
 import os
-from openai import OpenAI, AzureOpenAI
+from openai import OpenAI, AsyncOpenAI, AzureOpenAI
 from typing import Optional
 
 
@@ -35,8 +35,8 @@ def get_deployment_name() -> str:
     """
     return os.environ.get(f"DEPLOYMENT_NAME")
 
-def create_client(purpose: Optional[str] = None) -> OpenAI:
-    """Return an OpenAI client configured for Azure resource or global endpoint.
+def _client_kwargs(purpose: Optional[str] = None) -> dict:
+    """Return OpenAI client constructor kwargs for the Azure resource or global endpoint.
 
     Args:
         purpose: Optional hint (e.g. "embeddings") which allows forcing global endpoint
@@ -65,7 +65,7 @@ def create_client(purpose: Optional[str] = None) -> OpenAI:
     def make_global():
         if _verbose():
             print(f"[azure_openai] Using GLOBAL endpoint: {global_endpoint}")
-        return OpenAI(base_url=global_endpoint, api_key=global_key)
+        return dict(base_url=global_endpoint, api_key=global_key)
 
     # 1. Force global for embeddings
     if force_global_embed and global_key:
@@ -79,7 +79,7 @@ def create_client(purpose: Optional[str] = None) -> OpenAI:
     if azure_endpoint and azure_key:
         if _verbose():
             print(f"[azure_openai] Using AZURE RESOURCE endpoint: {azure_endpoint} (api_version={azure_api_version})")
-        return OpenAI(
+        return dict(
             base_url=azure_endpoint,
             api_key=azure_key,
         )
@@ -91,4 +91,14 @@ def create_client(purpose: Optional[str] = None) -> OpenAI:
     raise RuntimeError("No valid configuration. Set AZURE_OPENAI_* or OPENAI_API_KEY.")
 
 
-__all__ = ["create_client"]
+def create_client(purpose: Optional[str] = None) -> OpenAI:
+    """Return a synchronous OpenAI client (see _client_kwargs for endpoint selection)."""
+    return OpenAI(**_client_kwargs(purpose))
+
+
+def create_async_client(purpose: Optional[str] = None) -> AsyncOpenAI:
+    """Return an AsyncOpenAI client for use from async code (e.g. FastAPI routes)."""
+    return AsyncOpenAI(**_client_kwargs(purpose))
+
+
+__all__ = ["create_client", "create_async_client"]
@@ -13,7 +13,8 @@ Usage examples:
 Features:
   * Interactive chat loop with conversation history
   * File attachment support: .txt, .csv, .md, .pdf, .png, .jpg, .jpeg
-  * PDF text extraction via PyPDF2
+  * PDF text extraction via pypdfium2 (PyPDF2 fallback)
+  * Attachment payloads cached by (path, mtime, size)
   * Image base64 encoding for multimodal models
   * Loads system prompt from docs/system_prompt.md with fallback
   * Environment configuration via .env file
@@ -28,17 +29,26 @@ Commands during chat:
 
 from __future__ import annotations
 import os, argparse, base64, sys
+from io import BytesIO
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 
 from azure_openai import create_client, get_deployment_name
 
+try:
+	import pdf_pages  # needs pypdfium2 (C-backed); PyPDF2 fallback
+except ImportError:
+	pdf_pages = None
+
 load_dotenv()
 
 SUPPORTED_TEXT_EXT = {'.txt', '.csv', '.md'}
 SUPPORTED_PDF_EXT = {'.pdf'}
 SUPPORTED_IMG_EXT = {'.png', '.jpg', '.jpeg'}
 
+# (path, st_mtime_ns, st_size) -> payload; re-attaching an unchanged file skips the read/extract.
+_FILE_CACHE: Dict[tuple, Dict[str, Any]] = {}
+
 def load_system_prompt() -> str:
 	path = os.environ.get("SYSTEM_PROMPT_PATH", "docs/system_prompt.md")
 	if not os.path.exists(path):
@@ -60,33 +70,52 @@ def load_system_prompt() -> str:
 		return seg.strip()
 	return content[:4000]
 
+def _read_bytes(path: str) -> bytes:
+	with open(path, 'rb') as f:
+		return f.read()
+
+def _extract_pdf_text(path: str) -> str:
+	data = _read_bytes(path)
+	if pdf_pages is not None:
+		try:
+			# Skips pages that fail and normalizes CRLF, like the UI
+			return "\n".join(pdf_pages.extract_pages(data, 0, sys.maxsize)).strip()
+		except Exception:
+			pass  # PDFium could not open the file; try PyPDF2
+	import PyPDF2  # optional fallback
+	text_parts = []
+	reader = PyPDF2.PdfReader(BytesIO(data))
+	for page in reader.pages:
+		try:
+			text_parts.append(page.extract_text() or "")
+		except Exception:
+			pass
+	return "\n".join(text_parts).strip()
+
 def read_file_payload(path: str) -> Dict[str, Any]:
 	ext = os.path.splitext(path)[1].lower()
 	if ext in SUPPORTED_TEXT_EXT:
-		with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-			return {"type":"text","name":os.path.basename(path),"content":f.read()}
+		return {"type":"text","name":os.path.basename(path),"content":_read_bytes(path).decode('utf-8', errors='ignore').replace('\r\n', '\n')}
 	if ext in SUPPORTED_PDF_EXT:
 		try:
-			import PyPDF2  # optional
-			text_parts = []
-			with open(path, 'rb') as f:
-				reader = PyPDF2.PdfReader(f)
-				for page in reader.pages:
-					try:
-						text_parts.append(page.extract_text() or "")
-					except Exception:
-						pass
-			return {"type":"pdf","name":os.path.basename(path),"content":"\n".join(text_parts).strip()}
+			return {"type":"pdf","name":os.path.basename(path),"content":_extract_pdf_text(path)}
 		except Exception:
-			with open(path, 'rb') as f:
-				data = base64.b64encode(f.read()).decode('ascii')
+			data = base64.b64encode(_read_bytes(path)).decode('ascii')
 			return {"type":"pdf-bytes","name":os.path.basename(path),"data":data}
 	if ext in SUPPORTED_IMG_EXT:
-		with open(path, 'rb') as f:
-			data = base64.b64encode(f.read()).decode('ascii')
+		data = base64.b64encode(_read_bytes(path)).decode('ascii')
 		return {"type":"image","name":os.path.basename(path),"data":data}
 	raise ValueError(f"Unsupported file type: {path}")
 
+def load_file_payload(path: str) -> Dict[str, Any]:
+	"""read_file_payload memoized on (path, mtime, size); returns a fresh dict per call."""
+	st = os.stat(path)
+	key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+	payload = _FILE_CACHE.get(key)
+	if payload is None:
+		payload = _FILE_CACHE[key] = read_file_payload(path)
+	return dict(payload)
+
 class ChatSession:
     """Manages conversation state and file attachments for the chat session."""
     
@@ -104,14 +133,14 @@ class ChatSession:
             print(f"❌ File not found: {file_path}")
             return False
         
+        # Check if already attached
+        for existing in self.attached_files:
+            if existing.get('path') == file_path:
+                print(f"📎 File already attached: {os.path.basename(file_path)}")
+                return True
+        
         try:
-            file_data = read_file_payload(file_path)
-            # Check if already attached
-            for existing in self.attached_files:
-                if existing.get('path') == file_path:
-                    print(f"📎 File already attached: {os.path.basename(file_path)}")
-                    return True
-            
+            file_data = load_file_payload(file_path)
             file_data['path'] = file_path
             self.attached_files.append(file_data)
             print(f"📎 Attached: {os.path.basename(file_path)} ({file_data['type']})")
@@ -1,18 +1,36 @@
-import os, json, hashlib, pickle, argparse
+import os, json, hashlib, argparse, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
 import numpy as np
+from openai import BadRequestError, RateLimitError
 from azure_openai import create_client
+from quantize import quantize_int8
 from typing import Iterable, List, Dict
 
+try:
+    import xxhash  # optional; stdlib blake2b fallback
+except ImportError:
+    xxhash = None
+
 load_dotenv()
 
 DEFAULT_DATA_DIR = Path(os.environ.get("DATA_DIR", "data"))
 STORE_DIR = Path(os.environ.get("STORE_DIR", "vector_store"))
 STORE_DIR.mkdir(exist_ok=True)
-EMB_STORE = STORE_DIR / "embeddings.pkl"
+# Store layout (all index-aligned): emb.npy (N, D) float32 unit rows, emb_q.npy (N, D) int8
+# codes, emb_scales.npy (N,) float32, meta.jsonl one {id, text, source, chunk_index} per line.
+EMB_FILE = "emb.npy"
+EMB_Q_FILE = "emb_q.npy"
+EMB_SCALES_FILE = "emb_scales.npy"
+META_FILE = "meta.jsonl"
 
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
+EMBED_BATCH = int(os.environ.get("EMBED_BATCH", "96"))
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "8"))
+EMBED_MAX_RETRIES = 6
+# Chunk ids are opaque; CHUNK_ID_HASH=sha1 reproduces ids of stores built before xxh3 ids.
+CHUNK_ID_HASH = os.environ.get("CHUNK_ID_HASH", "xxh3").lower()
 client = create_client()
 
 def flatten(obj, parent="") -> List[str]:
@@ -37,30 +55,80 @@ def chunk_lines(lines: Iterable[str], max_chars=1200, overlap=120) -> Iterable[s
     for line in lines:
         if size + len(line) + 1 > max_chars and buffer:
             yield "\n".join(buffer)
-            # overlap tail
-            overlap_chars = 0
-            overlap_buf: List[str] = []
-            for bl in reversed(buffer):
-                overlap_chars += len(bl)
-                overlap_buf.append(bl)
-                if overlap_chars > overlap:
+            # overlap tail: keep the shortest suffix of lines exceeding `overlap` chars (or all);
+            # its length becomes the new running size, so no re-summing of the buffer.
+            j = len(buffer)
+            size = 0
+            while j > 0:
+                j -= 1
+                size += len(buffer[j])
+                if size > overlap:
                     break
-            buffer = list(reversed(overlap_buf))
-            size = sum(len(b) for b in buffer)
+            del buffer[:j]
         buffer.append(line)
         size += len(line)
     if buffer:
         yield "\n".join(buffer)
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Embed a list of texts. Simple sequential loop (hackathon scale)."""
-    embeddings: List[List[float]] = []
-    for i, t in enumerate(texts):
-        resp = client.embeddings.create(model=EMBED_MODEL, input=t)
-        embeddings.append(resp.data[0].embedding)
-        if (i+1) % 10 == 0:
-            print(f"  Embedded {i+1}/{len(texts)}")
-    return embeddings
+# BadRequestError codes and message fragments meaning the request was too large; only these
+# are worth retrying with smaller batches (a bad model name or input fails the same way again).
+_TOO_LARGE_CODES = {"context_length_exceeded", "max_tokens_per_request"}
+_TOO_LARGE_HINTS = ("maximum context length", "tokens per request", "too many tokens", "too many inputs", "maximum number of inputs")
+
+def _batch_too_large(e: BadRequestError) -> bool:
+    if e.code in _TOO_LARGE_CODES:
+        return True
+    message = (e.message or "").lower()
+    return any(hint in message for hint in _TOO_LARGE_HINTS)
+
+def _embed_batch(batch: List[str]) -> List[List[float]]:
+    """Embed one batch of texts, preserving input order.
+
+    Rate-limited (429) calls are retried with exponential backoff. If the endpoint rejects the
+    batch as too large (token or input-count limit) it is split in half and each half retried;
+    any other bad request is raised at once.
+    """
+    delay = 1.0
+    for attempt in range(EMBED_MAX_RETRIES):
+        try:
+            resp = client.embeddings.create(model=EMBED_MODEL, input=batch)
+            return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+        except RateLimitError:
+            if attempt == EMBED_MAX_RETRIES - 1:
+                raise
+            time.sleep(delay)
+            delay *= 2
+        except BadRequestError as e:
+            if len(batch) == 1 or not _batch_too_large(e):
+                raise
+            mid = len(batch) // 2
+            return _embed_batch(batch[:mid]) + _embed_batch(batch[mid:])
+
+def embed_texts(texts: List[str], batch_size: int = EMBED_BATCH, workers: int = EMBED_WORKERS) -> List[List[float]]:
+    """Embed a list of texts, sending up to batch_size inputs per request.
+
+    Batches are issued concurrently on a thread pool (the work is network-bound) and
+    reassembled by their starting offset, so output order matches input order.
+    """
+    starts = range(0, len(texts), batch_size)
+    results: Dict[int, List[List[float]]] = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futures = {ex.submit(_embed_batch, texts[s:s + batch_size]): s for s in starts}
+        for fut in as_completed(futures):
+            batch_embeddings = fut.result()
+            results[futures[fut]] = batch_embeddings
+            done += len(batch_embeddings)
+            print(f"  Embedded {done}/{len(texts)}")
+    return [emb for s in starts for emb in results[s]]
+
+def chunk_id(seed: bytes) -> str:
+    """Return a stable 128-bit hex id for a chunk seed (non-cryptographic)."""
+    if CHUNK_ID_HASH == "sha1":
+        return hashlib.sha1(seed).hexdigest()
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(seed)
+    return hashlib.blake2b(seed, digest_size=16).hexdigest()
 
 def discover_files(data_dir: Path) -> List[Path]:
     exts = {".json", ".txt", ".md"}
@@ -91,10 +159,10 @@ def load_and_chunk(path: Path, max_chars=1200, overlap=120) -> List[str]:
 def build_arg_parser():
     ap = argparse.ArgumentParser(description="Ingest all data files into local embedding store.")
     ap.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR, help="Directory containing source data files (json/txt/md).")
-    ap.add_argument("--out", type=Path, default=EMB_STORE, help="Output embeddings pickle path.")
+    ap.add_argument("--out", type=Path, default=STORE_DIR, help="Output vector store directory.")
     ap.add_argument("--max-chars", type=int, default=int(os.environ.get("CHUNK_MAX_CHARS", 1200)))
     ap.add_argument("--overlap", type=int, default=int(os.environ.get("CHUNK_OVERLAP", 120)))
-    ap.add_argument("--force", action="store_true", help="Overwrite existing embeddings file.")
+    ap.add_argument("--force", action="store_true", help="Overwrite an existing vector store.")
     return ap
 
 def main():
@@ -105,10 +173,10 @@ def main():
         raise SystemExit("EMBED_MODEL not set. Deploy an embedding model (e.g. text-embedding-3-small) and set EMBED_MODEL env var.")
 
     data_dir: Path = args.data_dir
-    out_path: Path = args.out
+    out_dir: Path = args.out
 
-    if out_path.exists() and not args.force:
-        print(f"Output {out_path} exists. Use --force to overwrite.")
+    if (out_dir / META_FILE).exists() and not args.force:
+        print(f"Vector store in {out_dir} exists. Use --force to overwrite.")
         return
     if not data_dir.exists():
         raise SystemExit(f"Data directory not found: {data_dir}")
@@ -131,24 +199,31 @@ def main():
             })
         total_chunks += len(chunks)
 
+    if not all_chunks:
+        raise SystemExit(f"No text to embed in {data_dir}: every supported file produced zero chunks")
     print(f"Total chunks: {total_chunks}. Embedding...")
     embeddings = embed_texts([c["text"] for c in all_chunks])
 
-    records = []
-    for rec, emb in zip(all_chunks, embeddings):
-        uid_seed = f"{rec['source']}:::{rec['chunk_index']}".encode()
-        rec_id = hashlib.sha1(uid_seed).hexdigest()
-        records.append({
-            "id": rec_id,
-            "text": rec["text"],
-            "embedding": np.array(emb, dtype="float32"),
-            "source": rec["source"],
-            "chunk_index": rec["chunk_index"],
-        })
-
-    with open(out_path, "wb") as f:
-        pickle.dump(records, f)
-    print(f"Stored {len(records)} chunks in {out_path}")
+    # Rows are L2-normalized once here so the API can memory-map the matrix read-only.
+    mat = np.asarray(embeddings, dtype=np.float32)
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9
+    codes, scales = quantize_int8(mat)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir / EMB_FILE, mat)
+    np.save(out_dir / EMB_Q_FILE, codes)
+    np.save(out_dir / EMB_SCALES_FILE, scales)
+    with open(out_dir / META_FILE, "w", encoding="utf-8") as f:
+        for rec in all_chunks:
+            uid_seed = f"{rec['source']}:::{rec['chunk_index']}".encode()
+            rec_id = chunk_id(uid_seed)
+            f.write(json.dumps({
+                "id": rec_id,
+                "text": rec["text"],
+                "source": rec["source"],
+                "chunk_index": rec["chunk_index"],
+            }, ensure_ascii=False) + "\n")
+    print(f"Stored {len(all_chunks)} chunks in {out_dir}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
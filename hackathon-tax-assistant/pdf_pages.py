@@ -0,0 +1,124 @@
+"""PDF page text extraction with PDFium (pypdfium2).
+
+Used by ui.py for uploaded PDFs. It is kept in its own importable module so that
+extract_pages can be pickled by reference and run in worker processes: PDFium is not
+thread-safe, so pages of one large PDF are split across processes rather than threads.
+"""
+
+import multiprocessing
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+import pypdfium2 as pdfium
+
+
+def page_count(data: bytes) -> int:
+    pdf = pdfium.PdfDocument(data)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def extract_pages(data: bytes, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop), skipping pages that fail to extract.
+
+    PDFium's CRLF line ends are normalized to LF to match PyPDF2's output.
+    """
+    texts = []
+    pdf = pdfium.PdfDocument(data)
+    try:
+        for i in range(start, min(stop, len(pdf))):
+            try:
+                page = pdf[i]
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range().replace("\r\n", "\n"))
+                textpage.close()
+                page.close()
+            except Exception:
+                continue
+    finally:
+        pdf.close()
+    return texts
+
+
+# Shared pool, started on the Streamlit script thread by ensure_pool and used from any thread
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _wait_for_siblings(barrier) -> None:
+    barrier.wait(timeout=60)
+
+
+def make_pool(workers: int) -> ProcessPoolExecutor:
+    """Spawn-based process pool for extract_pages, with every worker started before it returns.
+
+    Under `streamlit run` the app script is __main__, and spawn would re-run it in each
+    new worker; an empty stand-in is installed while the workers start, so call this from
+    the script thread. ProcessPoolExecutor starts workers on submit, so one task per worker
+    is submitted meanwhile, each held in the initializer until all workers are up. No worker
+    is started afterwards: if one dies the pool raises BrokenProcessPool rather than
+    replacing it.
+
+    The swap is process-wide: a Streamlit session whose script run starts during it sets
+    __main__ itself, and a worker spawned then would run that script. ui.py therefore only
+    uses the pool when PDF_WORKERS is set to 2 or more.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    main = sys.modules["__main__"]
+    stand_in = sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        pool = ProcessPoolExecutor(workers, mp_context=ctx, initializer=_wait_for_siblings, initargs=(barrier,))
+        warmup = [pool.submit(int) for _ in range(workers)]
+    finally:
+        # Leave alone a module another session's script run installed in the meantime
+        if sys.modules.get("__main__") is stand_in:
+            sys.modules["__main__"] = main
+    try:
+        for future in warmup:
+            future.result()
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    return pool
+
+
+def ensure_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """Start the shared pool if it isn't running; None if it cannot be started."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = make_pool(workers)
+            except Exception:
+                return None
+        return _pool
+
+
+def extract_parallel(data: bytes, n: int, workers: int) -> Optional[List[str]]:
+    """Text of pages [0, n) split into page ranges across the shared pool, in page order.
+
+    None if no pool is running or it broke (a worker died, e.g. PDFium crashing on this
+    file); the broken pool is dropped so the next ensure_pool starts a fresh one.
+    """
+    global _pool
+    pool = _pool
+    if pool is None:
+        return None
+    step = -(-n // workers)
+    starts = range(0, n, step)
+    try:
+        chunks = list(pool.map(extract_pages, [data] * len(starts), starts, [start + step for start in starts]))
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        return None
+    return [text for chunk in chunks for text in chunk]
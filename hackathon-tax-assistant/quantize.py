@@ -0,0 +1,17 @@
+"""Int8 quantization shared by ingest.py (stored codes) and app.py (query vectors).
+
+Both sides must use the same definition: app.py scores int8 query codes against the
+emb_q.npy / emb_scales.npy files written by ingest.py.
+"""
+
+import numpy as np
+
+
+def quantize_int8(x: np.ndarray):
+    """Symmetric int8 quantization along the last axis.
+
+    Returns (int8 codes, float32 scales) such that codes[..., i] * scales ~= x[..., i]:
+    one scale per row of a matrix, a single scale for a vector.
+    """
+    scales = np.max(np.abs(x), axis=-1, keepdims=True) / 127.0 + 1e-12
+    return np.round(x / scales).astype(np.int8), scales.squeeze(-1).astype(np.float32)
@@ -4,40 +4,261 @@ Processes comprehensive tax scenarios and creates enriched training data
 """
 import json
 import os
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+try:
+    import orjson  # optional, much faster (de)serialization; stdlib json fallback
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+else:
+    _loads = json.loads
+
+    def _dumps(obj, indent: bool = False) -> bytes:
+        # Same bytes orjson would produce: UTF-8, compact unless indented.
+        if indent:
+            return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+_READ_CHUNK = 1 << 20
+
+# Markers every assistant answer must contain; found with one regex pass per answer.
+REQUIRED_ELEMENTS = [
+    "Summary:",
+    "table format",
+    "⚠️ **Disclaimer:**"
+]
+_REQUIRED_RE = re.compile('|'.join(map(re.escape, REQUIRED_ELEMENTS)))
+
+# Scenario buckets in priority order. Each branch is a lookahead over the whole question, so
+# an earlier scenario wins regardless of where its keyword appears; lastgroup names the bucket.
+_SCENARIO_RE = re.compile(
+    r'(?=.*?(?P<salary_analysis>salary|form 16))'
+    r'|(?=.*?(?P<regime_comparison>regime))'
+    r'|(?=.*?(?P<investment_planning>investment|80c))',
+    re.IGNORECASE | re.DOTALL,
+)
+# Interned bucket names indexed by group number - 1, so counting is a tuple index.
+_SCEN_KEYS = tuple(sys.intern(name) for name in sorted(_SCENARIO_RE.groupindex, key=_SCENARIO_RE.groupindex.get))
+
+def _iter_lines(f):
+    """Yield the lines of binary file f as bytes, without the newline, reading 1 MiB at a time."""
+    pending = []  # chunk tails not yet terminated by a newline
+    while True:
+        chunk = f.read1(_READ_CHUNK)
+        if not chunk:
+            break
+        pending.append(chunk)
+        if b'\n' not in chunk:
+            continue
+        buf = b''.join(pending)
+        pending.clear()
+        pos = 0
+        nl = buf.find(b'\n')
+        while nl != -1:
+            yield buf[pos:nl]
+            pos = nl + 1
+            nl = buf.find(b'\n', pos)
+        if pos < len(buf):
+            pending.append(buf[pos:])
+    if pending:
+        yield b''.join(pending)
+
+# Files merged into combined_comprehensive_finetune.jsonl, and files checked by validation.
+DATA_FILES = [
+    "training_data/form16_finetune.jsonl",
+    "training_data/comprehensive_tax_finetune.jsonl", 
+    "training_data/form16_detailed_analysis.jsonl"
+]
+VALIDATION_FILES = [
+    "training_data/comprehensive_tax_finetune.jsonl",
+    "training_data/form16_detailed_analysis.jsonl",
+    "training_data/comprehensive_validation.jsonl"
+]
+
+COMBINED_FILE = "training_data/combined_comprehensive_finetune.jsonl"
+# Validation issues are streamed here as NDJSON; validation_results.json keeps only counts.
+ISSUES_FILE = "training_data/validation_issues.jsonl"
+
+def _validate_example(data, file_path, line_num, report_issue, scenario_coverage):
+    """Report missing required elements and count the scenario bucket for one parsed example"""
+    # Check for assistant response completeness
+    messages = data.get("messages", [])
+    # First assistant and first user message, found in one pass
+    assistant_msg = user_msg = None
+    for msg in messages:
+        role = msg.get("role")
+        if role == "assistant" and assistant_msg is None:
+            assistant_msg = msg
+        elif role == "user" and user_msg is None:
+            user_msg = msg
+        if assistant_msg is not None and user_msg is not None:
+            break
+    
+    if assistant_msg:
+        content = assistant_msg["content"]
+        
+        # Check for required elements
+        found = {m.group(0) for m in _REQUIRED_RE.finditer(content)}
+        for element in REQUIRED_ELEMENTS:
+            if element not in found:
+                report_issue({
+                    "file": file_path,
+                    "line": line_num,
+                    "missing": element
+                })
+        
+        # Categorize by scenario
+        if user_msg:
+            m = _SCENARIO_RE.match(user_msg["content"])
+            if m:
+                scenario_coverage[_SCEN_KEYS[m.lastindex - 1]] += 1
+
+def _spool():
+    """Open a temporary file for one worker's output; returns (path, binary file)."""
+    fd, path = tempfile.mkstemp(suffix='.jsonl')
+    return path, os.fdopen(fd, 'wb')
+
+def _scan_file(file_path, combine, validate):
+    """Parse one training file for the combiner and/or validator.
+
+    Runs in a worker process. Combined lines and issues are streamed to temporary JSONL
+    files as they are produced, so only small results come back serialized: (log lines,
+    combined file path, examples combined, examples validated, scenario Counter, issues
+    file path, issues count), or None if the file does not exist. Unused paths are None.
+    """
+    try:
+        f = open(file_path, 'rb')
+    except FileNotFoundError:
+        return None
+
+    log = []
+    combined_path = combined_fp = issues_path = issues_fp = None
+    combined = 0
+    total = 0
+    issues = 0
+    scenario_coverage = Counter()
+    
+    def report_issue(issue):
+        nonlocal issues
+        issues_fp.write(_dumps(issue) + b'\n')
+        issues += 1
+    
+    if combine:
+        log.append(f"Processing {file_path}...")
+        combined_path, combined_fp = _spool()
+    if validate:
+        issues_path, issues_fp = _spool()
+    try:
+        with f:
+            for line_num, line in enumerate(_iter_lines(f), 1):
+                try:
+                    data = _loads(line)
+                except json.JSONDecodeError as e:
+                    if combine:
+                        log.append(f"Error processing line in {file_path}: {e}")
+                    if validate:
+                        report_issue({
+                            "file": file_path,
+                            "line": line_num,
+                            "error": f"JSON decode error: {e}"
+                        })
+                    continue
+                if combine:
+                    combined_fp.write(_dumps(data) + b'\n')
+                    combined += 1
+                if validate:
+                    total += 1
+                    _validate_example(data, file_path, line_num, report_issue, scenario_coverage)
+    finally:
+        for fp in (combined_fp, issues_fp):
+            if fp is not None:
+                fp.close()
+    return log, combined_path, combined, total, scenario_coverage, issues_path, issues
+
+def _drain(path, out_fp):
+    """Append a worker's temporary file to out_fp and delete it."""
+    if path is None:
+        return
+    try:
+        if out_fp is not None:
+            with open(path, 'rb') as src:
+                shutil.copyfileobj(src, out_fp, _READ_CHUNK)
+    finally:
+        os.remove(path)
+
+def _scan_training_files(combine_files, validate_files):
+    """Read and parse each file once, feeding every example to the combiner and/or validator.
+
+    Files are parsed in parallel worker processes (inline when there is only one). Each
+    result is appended to COMBINED_FILE / ISSUES_FILE in list order as it arrives, so memory
+    does not grow with the number of examples or issues. Returns (examples combined,
+    validation_results).
+    """
+    # Union of both lists, keeping each list's own order
+    all_files = list(dict.fromkeys([*combine_files, *validate_files]))
+    combine_flags = [p in combine_files for p in all_files]
+    validate_flags = [p in validate_files for p in all_files]
+    
+    combined = 0
+    validation_results = {
+        "total_examples": 0,
+        "scenario_coverage": {},
+        "issues_count": 0,
+        "issues_file": ISSUES_FILE
+    }
+    scenario_coverage = Counter()
+    combined_fp = open(COMBINED_FILE, 'wb') if combine_files else None
+    issues_fp = open(ISSUES_FILE, 'wb') if validate_files else None
+    
+    def merge(results):
+        nonlocal combined
+        for result in results:
+            if result is None:  # missing file
+                continue
+            log, combined_path, n_combined, total, coverage, issues_path, n_issues = result
+            for msg in log:
+                print(msg)
+            _drain(combined_path, combined_fp)
+            _drain(issues_path, issues_fp)
+            combined += n_combined
+            validation_results["total_examples"] += total
+            scenario_coverage.update(coverage)
+            validation_results["issues_count"] += n_issues
+    
+    try:
+        if len(all_files) <= 1:
+            merge(map(_scan_file, all_files, combine_flags, validate_flags))
+        else:
+            with ProcessPoolExecutor(max_workers=min(len(all_files), os.cpu_count() or 1)) as ex:
+                merge(ex.map(_scan_file, all_files, combine_flags, validate_flags))
+    finally:
+        for fp in (combined_fp, issues_fp):
+            if fp is not None:
+                fp.close()
+    
+    validation_results["scenario_coverage"] = dict(scenario_coverage)
+    return combined, validation_results
+
+def _report_combined(combined):
+    print(f"Combined {combined} training examples into {COMBINED_FILE}")
+
 def process_comprehensive_tax_data():
     """Process and combine all tax training data files"""
-    
-    # Define all training data files
-    data_files = [
-        "training_data/form16_finetune.jsonl",
-        "training_data/comprehensive_tax_finetune.jsonl", 
-        "training_data/form16_detailed_analysis.jsonl"
-    ]
-    
-    combined_data = []
-    
-    for file_path in data_files:
-        if os.path.exists(file_path):
-            print(f"Processing {file_path}...")
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        data = json.loads(line.strip())
-                        combined_data.append(data)
-                    except json.JSONDecodeError as e:
-                        print(f"Error processing line in {file_path}: {e}")
-                        continue
-    
-    # Save combined training data
-    output_file = "training_data/combined_comprehensive_finetune.jsonl"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for data in combined_data:
-            f.write(json.dumps(data, ensure_ascii=False) + '\n')
-    
-    print(f"Combined {len(combined_data)} training examples into {output_file}")
-    return len(combined_data)
+    combined, _ = _scan_training_files(DATA_FILES, ())
+    _report_combined(combined)
+    return combined
 
 def create_tax_scenario_templates():
     """Create templates for common tax scenarios"""
@@ -82,85 +303,37 @@ def create_tax_scenario_templates():
     }
     
     # Save scenario templates
-    with open("data/tax_scenario_templates.json", 'w', encoding='utf-8') as f:
-        json.dump(scenarios, f, indent=2, ensure_ascii=False)
+    with open("data/tax_scenario_templates.json", 'wb') as f:
+        f.write(_dumps(scenarios, indent=True))
     
     print("Created tax scenario templates")
     return scenarios
 
-def validate_training_data():
-    """Validate the training data for completeness and accuracy"""
-    
-    validation_results = {
-        "total_examples": 0,
-        "scenario_coverage": {},
-        "missing_elements": []
-    }
-    
-    required_elements = [
-        "Summary:",
-        "table format",
-        "⚠️ **Disclaimer:**"
-    ]
-    
-    files_to_validate = [
-        "training_data/comprehensive_tax_finetune.jsonl",
-        "training_data/form16_detailed_analysis.jsonl",
-        "training_data/comprehensive_validation.jsonl"
-    ]
-    
-    for file_path in files_to_validate:
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f, 1):
-                    try:
-                        data = json.loads(line.strip())
-                        validation_results["total_examples"] += 1
-                        
-                        # Check for assistant response completeness
-                        messages = data.get("messages", [])
-                        assistant_msg = next((msg for msg in messages if msg["role"] == "assistant"), None)
-                        
-                        if assistant_msg:
-                            content = assistant_msg["content"]
-                            
-                            # Check for required elements
-                            for element in required_elements:
-                                if element not in content:
-                                    validation_results["missing_elements"].append({
-                                        "file": file_path,
-                                        "line": line_num,
-                                        "missing": element
-                                    })
-                            
-                            # Categorize by scenario
-                            user_msg = next((msg for msg in messages if msg["role"] == "user"), None)
-                            if user_msg:
-                                user_question = user_msg["content"].lower()
-                                if "salary" in user_question or "form 16" in user_question:
-                                    validation_results["scenario_coverage"]["salary_analysis"] = validation_results["scenario_coverage"].get("salary_analysis", 0) + 1
-                                elif "regime" in user_question:
-                                    validation_results["scenario_coverage"]["regime_comparison"] = validation_results["scenario_coverage"].get("regime_comparison", 0) + 1
-                                elif "investment" in user_question or "80c" in user_question:
-                                    validation_results["scenario_coverage"]["investment_planning"] = validation_results["scenario_coverage"].get("investment_planning", 0) + 1
-                                
-                    except json.JSONDecodeError as e:
-                        validation_results["missing_elements"].append({
-                            "file": file_path,
-                            "line": line_num,
-                            "error": f"JSON decode error: {e}"
-                        })
-    
+def _write_validation_results(validation_results):
     # Save validation results
-    with open("training_data/validation_results.json", 'w', encoding='utf-8') as f:
-        json.dump(validation_results, f, indent=2, ensure_ascii=False)
+    with open("training_data/validation_results.json", 'wb') as f:
+        f.write(_dumps(validation_results, indent=True))
     
     print(f"Validation complete: {validation_results['total_examples']} examples processed")
     print(f"Scenario coverage: {validation_results['scenario_coverage']}")
-    print(f"Issues found: {len(validation_results['missing_elements'])}")
-    
+    print(f"Issues found: {validation_results['issues_count']} (details in {ISSUES_FILE})")
+
+def validate_training_data():
+    """Validate the training data for completeness and accuracy"""
+    _, validation_results = _scan_training_files((), VALIDATION_FILES)
+    _write_validation_results(validation_results)
     return validation_results
 
+def process_and_validate():
+    """Combine and validate in one pass: files in both lists are read and parsed only once.
+
+    Returns (total_examples, validation_results).
+    """
+    combined, validation_results = _scan_training_files(DATA_FILES, VALIDATION_FILES)
+    _report_combined(combined)
+    _write_validation_results(validation_results)
+    return combined, validation_results
+
 def main():
     """Main processing function"""
     print("Starting comprehensive tax data processing...")
@@ -169,26 +342,24 @@ def main():
     os.makedirs("training_data", exist_ok=True)
     os.makedirs("data", exist_ok=True)
     
-    # Process training data
-    total_examples = process_comprehensive_tax_data()
+    # Process and validate training data
+    total_examples, validation_results = process_and_validate()
     
     # Create scenario templates
     scenarios = create_tax_scenario_templates()
     
-    # Validate training data
-    validation_results = validate_training_data()
-    
     print(f"""
     Processing Summary:
     ==================
     Total training examples: {total_examples}
     Scenario templates created: {len(scenarios)}
-    Validation issues: {len(validation_results['missing_elements'])}
+    Validation issues: {validation_results['issues_count']}
     
     Files created:
     - training_data/combined_comprehensive_finetune.jsonl
     - data/tax_scenario_templates.json
     - training_data/validation_results.json
+    - training_data/validation_issues.jsonl
     """)
 
 if __name__ == "__main__":
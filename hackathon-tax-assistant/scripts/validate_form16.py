@@ -16,11 +16,22 @@ Outputs:
 This is intentionally lightweight; real-world PDFs should be OCR'd & normalized upstream.
 """
 from __future__ import annotations
-import re, json, argparse, sys
+import re, json, math, argparse, sys, functools
+from array import array
 from dataclasses import dataclass, field, asdict
 from typing import Optional, List, Dict
 
-RE_FIELD = re.compile(r"^(?P<k>[A-Za-z0-9 /()%-]+):\s*(?P<v>.+)$")
+try:
+    import orjson  # optional, faster JSON output; stdlib json fallback
+except ImportError:
+    orjson = None
+
+# Parsing works on the raw file bytes; only captured names and values are decoded.
+# One match per line splits it at the first colon. Group k is set when the text before the
+# colon is a plain field key (letters, digits, spaces, /()%-); otherwise it lands in group name.
+RE_FIELD = re.compile(rb"(?:(?P<k>[A-Za-z0-9 /()%-]+)|(?P<name>[^:]*)):\s*(?P<v>.*)", re.DOTALL)
+# ASCII line breaks (bytes.splitlines() would miss form feeds from PDF text extraction).
+_LINE_SPLIT_RE = re.compile(rb"[\r\n\x0b\x0c]")
 
 MANDATORY_TOP = [
     "Financial Year",
@@ -31,14 +42,17 @@ MANDATORY_TOP = [
     "Employee PAN",
 ]
 
-@dataclass
+# __slots__ instead of a per-instance __dict__ (dataclass(slots=...) needs Python 3.10+).
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**_SLOTS)
 class SalaryComponent:
     name: str
     amount: float
     exempt: bool = False
     notes: Optional[str] = None
 
-@dataclass
+@dataclass(**_SLOTS)
 class Form16Summary:
     financial_year: Optional[str] = None
     employer_name: Optional[str] = None
@@ -61,6 +75,9 @@ class Form16Summary:
     issues: List[str] = field(default_factory=list)
 
     def to_json(self) -> str:
+        if orjson is not None:
+            # orjson walks the dataclass directly; no intermediate asdict() copy
+            return orjson.dumps(self, option=orjson.OPT_INDENT_2).decode("utf-8")
         return json.dumps(asdict(self), indent=2)
 
 SECTION_HEADERS = {
@@ -72,128 +89,184 @@ SECTION_HEADERS = {
     "taxable income computation": "taxable_computation",
     "taxable income derivation": "taxable_computation",
 }
+_SECTION_HEADERS_B = {k.encode("ascii"): v for k, v in SECTION_HEADERS.items()}
+# Matches a whole header line in any case, so non-header lines are rejected without lower().
+_SECTION_RE = re.compile(
+    rb"\s*(" + b"|".join(map(re.escape, _SECTION_HEADERS_B)) + rb")\s*", re.IGNORECASE
+)
+# First letters of the headers in either case; other lines skip the header regex entirely.
+_HEADER_FIRST_BYTES = frozenset(k[:1] for k in _SECTION_HEADERS_B) | frozenset(k[:1].upper() for k in _SECTION_HEADERS_B)
+
+MONEY_RE = re.compile(rb"(?<![A-Za-z0-9])([0-9]{1,3}(?:,[0-9]{3})*|[0-9]+)(?![A-Za-z0-9])")
 
-MONEY_RE = re.compile(r"(?<![A-Za-z0-9])([0-9]{1,3}(?:,[0-9]{3})*|[0-9]+)(?![A-Za-z0-9])")
+# Plain (optionally signed, comma-grouped, decimal) numbers take the fast path in parse_money.
+_FAST_NUM_RE = re.compile(rb"[+-]?(?:[0-9][0-9,]*(?:\.[0-9]*)?|\.[0-9]+)")
+_NA_SET = frozenset({b"na", b"n/a", b"nil"})
 
-FLOAT_CLEAN = lambda s: float(s.replace(",", ""))
 
+def _text(b: bytes) -> str:
+    return b.decode("utf-8", "replace").strip()
 
-def parse_money(s: str) -> Optional[float]:
+
+def parse_money(s: bytes) -> Optional[float]:
+    if isinstance(s, str):
+        s = s.encode("utf-8")
     s = s.strip()
-    try:
-        if s.lower() in {"na", "n/a", "nil"}:
-            return 0.0
-        return FLOAT_CLEAN(s)
-    except Exception:
-        m = MONEY_RE.search(s)
-        if m:
-            try:
-                return FLOAT_CLEAN(m.group(1))
-            except Exception:
-                return None
+    if not s:
         return None
+    if s.lower() in _NA_SET:
+        return 0.0
+    if _FAST_NUM_RE.fullmatch(s):
+        return float(s.replace(b",", b""))
+    # Mixed text such as "15000 (approx)": take the first standalone number
+    m = MONEY_RE.search(s)
+    if m:
+        return float(m.group(1).replace(b",", b""))
+    return None
+
+
+# Exact (lowercased) key -> Form16Summary attribute; the value is stored as-is.
+_EXACT_FIELDS = {
+    "financial year": "financial_year",
+    "employer name": "employer_name",
+    "employer tan": "employer_tan",
+    "employer pan": "employer_pan",
+    "employee name": "employee_name",
+    "employee pan": "employee_pan",
+}
+
+# (key prefixes, attribute, converter or None). The prefixes are disjoint, so at most one
+# entry matches a given key and the scan order does not matter.
+_PREFIX_FIELDS = [
+    (("period of employment",), "period_of_employment", None),
+    (("previous employer",), "previous_employer", None),
+    (("gross salary total",), "gross_salary_total", parse_money),
+    (("standard deduction",), "standard_deduction", parse_money),
+    (("hra exempt",), "hra_exempt", parse_money),
+    (("consolidated tds",), "consolidated_tds", parse_money),
+    (("refund due", "estimated additional tax payable"), "refund_or_payable", parse_money),
+]
+
+
+def _add_salary_component(summary: Form16Summary, name: bytes, val: bytes) -> Optional[float]:
+    amt = parse_money(val)
+    if amt is not None:
+        summary.salary_components.append(SalaryComponent(name=_text(name), amount=amt))
+    return amt
+
+
+def _add_exemption(summary: Form16Summary, name: bytes, val: bytes) -> None:
+    pv = parse_money(val)
+    if pv is not None:
+        summary.exemptions[_text(name)] = pv
+
+
+def _add_chapter_via(summary: Form16Summary, name: bytes, val: bytes) -> None:
+    pv = parse_money(val)
+    if pv is not None:
+        summary.chapter_via_deductions[_text(name)] = pv
+
+
+# Sections whose "name: amount" lines are captured when they are not known fields
+_SECTION_HANDLERS = {
+    "exempt_allowances": _add_exemption,
+    "chapter_via": _add_chapter_via,
+}
 
 
-def parse_file(text: str) -> Form16Summary:
-    lines = [l.rstrip() for l in text.splitlines() if l.strip()]
+def parse_file(text: bytes) -> Form16Summary:
+    """Parse Form 16 text (raw bytes as read from disk; str is encoded first)."""
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    lines = [l.rstrip() for l in _LINE_SPLIT_RE.split(text) if l.strip()]
     summary = Form16Summary()
     current_section = None
-    in_salary_block = False
+    # Component amounts kept contiguously alongside salary_components for the totals check
+    component_amounts = array("d")
 
     for raw in lines:
-        low = raw.lower()
         # Detect section header
-        if low.strip() in SECTION_HEADERS:
-            current_section = SECTION_HEADERS[low.strip()]
-            if current_section == "gross_salary":
-                in_salary_block = True
-            else:
-                in_salary_block = False
-            continue
-
-        # Salary components heuristics
-        if in_salary_block:
-            if ":" in raw:
-                parts = raw.split(":", 1)
-                name = parts[0].strip()
-                amt = parse_money(parts[1])
-                if amt is not None:
-                    summary.salary_components.append(SalaryComponent(name=name, amount=amt))
+        if raw.lstrip()[:1] in _HEADER_FIRST_BYTES:
+            hm = _SECTION_RE.fullmatch(raw)
+            if hm:
+                current_section = _SECTION_HEADERS_B[hm.group(1).lower()]
                 continue
 
-        # Generic key: value parse
         m = RE_FIELD.match(raw)
-        if m:
-            k = m.group("k").strip()
-            v = m.group("v").strip()
-            kl = k.lower()
-            if kl == "financial year": summary.financial_year = v
-            elif kl == "employer name": summary.employer_name = v
-            elif kl == "employer tan": summary.employer_tan = v
-            elif kl == "employer pan": summary.employer_pan = v
-            elif kl == "employee name": summary.employee_name = v
-            elif kl == "employee pan": summary.employee_pan = v
-            elif kl.startswith("period of employment"): summary.period_of_employment = v
-            elif kl.startswith("previous employer"): summary.previous_employer = v
-            elif kl.startswith("gross salary total"): summary.gross_salary_total = parse_money(v)
-            elif kl.startswith("standard deduction"): summary.standard_deduction = parse_money(v)
-            elif kl.startswith("hra exempt"): summary.hra_exempt = parse_money(v)
-            elif kl.startswith("total chapter vi-a") or kl.startswith("total chapter vi-a (allowed)"):
-                summary.chapter_via_deductions["TOTAL"] = parse_money(v)
-            elif kl.startswith("tds deducted") or kl.startswith("total tds (current employer)"):
-                val = parse_money(v)
-                if summary.tds_deducted is None:
-                    summary.tds_deducted = val
-                else:
-                    if val: summary.tds_deducted += val
-            elif kl.startswith("consolidated tds"):
-                summary.consolidated_tds = parse_money(v)
-            elif kl.startswith("taxable income") and "approx" not in kl:
-                maybe = parse_money(v)
-                if maybe: summary.taxable_income = maybe
-            elif kl.startswith("refund due") or kl.startswith("estimated additional tax payable"):
-                summary.refund_or_payable = parse_money(v)
+        if not m:
             continue
+        key = m.group("k")
+        v = m.group("v")
 
-        # Exempt allowances & deductions simple capture
-        if current_section == "exempt_allowances" and ":" in raw:
-            name, val = raw.split(":", 1)
-            pv = parse_money(val)
-            if pv is not None:
-                summary.exemptions[name.strip()] = pv
+        # Every "name: amount" line in the salary block is a component
+        if current_section == "gross_salary":
+            amt = _add_salary_component(summary, key if key is not None else m.group("name"), v)
+            if amt is not None:
+                component_amounts.append(amt)
             continue
-        if current_section == "chapter_via" and ":" in raw:
-            name, val = raw.split(":", 1)
-            pv = parse_money(val)
-            if pv is not None:
-                summary.chapter_via_deductions[name.strip()] = pv
+
+        # Generic key: value parse
+        if key is not None and v:
+            kl = key.strip().lower().decode("ascii")
+            attr = _EXACT_FIELDS.get(kl)
+            if attr is not None:
+                setattr(summary, attr, _text(v))
+                continue
+            for prefixes, attr, conv in _PREFIX_FIELDS:
+                if kl.startswith(prefixes):
+                    setattr(summary, attr, _text(v) if conv is None else conv(v))
+                    break
+            else:
+                # Fields with accumulation or guard logic
+                if kl.startswith("total chapter vi-a"):
+                    summary.chapter_via_deductions["TOTAL"] = parse_money(v)
+                elif kl.startswith(("tds deducted", "total tds (current employer)")):
+                    val = parse_money(v)
+                    if summary.tds_deducted is None:
+                        summary.tds_deducted = val
+                    else:
+                        if val: summary.tds_deducted += val
+                elif kl.startswith("taxable income") and "approx" not in kl:
+                    maybe = parse_money(v)
+                    if maybe: summary.taxable_income = maybe
             continue
 
+        # Exempt allowances & deductions simple capture
+        handler = _SECTION_HANDLERS.get(current_section)
+        if handler is not None:
+            handler(summary, key if key is not None else m.group("name"), v)
+
     # Post-processing checks
     for field_name in MANDATORY_TOP:
         if getattr(summary, field_name.lower().replace(" ", "_"), None) is None:
             summary.issues.append(f"Missing top-level field: {field_name}")
 
-    if summary.gross_salary_total is None and summary.salary_components:
-        comp_sum = sum(c.amount for c in summary.salary_components)
-        summary.gross_salary_total = comp_sum
-    if summary.gross_salary_total and summary.salary_components:
-        comp_sum = sum(c.amount for c in summary.salary_components)
-        if abs(comp_sum - summary.gross_salary_total) > 1:
+    if summary.salary_components:
+        comp_sum = math.fsum(component_amounts)
+        if summary.gross_salary_total is None:
+            summary.gross_salary_total = comp_sum
+        if summary.gross_salary_total and abs(comp_sum - summary.gross_salary_total) > 1:
             summary.issues.append(f"Gross salary total mismatch: components={comp_sum} vs stated={summary.gross_salary_total}")
 
     return summary
 
 
-def build_llm_validation_prompt(summary: Form16Summary) -> str:
+@functools.lru_cache(maxsize=1024)
+def _validation_prompt(summary_json: str) -> str:
+    # Keyed by the serialized summary (dataclasses are unhashable); identical summaries in a
+    # batch share one prompt string.
     return (
         "You are to validate a parsed Form 16 summary. Check for: "
         "(1) Mandatory IDs, (2) HRA vs salary consistency, (3) Chapter VI-A totals, "
         "(4) Gross salary reconstruction vs components, (5) Any impossible values. "
-        "Respond in JSON with keys: issues[], warnings[], confirmations[].\n\nParsed Summary:\n" + summary.to_json()
+        "Respond in JSON with keys: issues[], warnings[], confirmations[].\n\nParsed Summary:\n" + summary_json
     )
 
 
+def build_llm_validation_prompt(summary: Form16Summary) -> str:
+    return _validation_prompt(summary.to_json())
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--path", required=True, help="Path to Form 16 text file")
@@ -201,7 +274,7 @@ def main():
     args = ap.parse_args()
 
     try:
-        with open(args.path, "r", encoding="utf-8") as f:
+        with open(args.path, "rb") as f:
             text = f.read()
     except FileNotFoundError:
         print(f"File not found: {args.path}", file=sys.stderr)
@@ -2,13 +2,35 @@
 
 import streamlit as st
 import os
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import re
 import base64
-from typing import List, Dict, Any, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO, StringIO
+from functools import lru_cache
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime
+
+try:
+    import pdf_pages  # needs pypdfium2 (native PDFium text extraction); PyPDF2 fallback
+except ImportError:
+    pdf_pages = None
+try:
+    import PyPDF2  # optional; PDF uploads are rejected without either library
+except ImportError:
+    PyPDF2 = None
+try:
+    from PIL import Image  # optional; only needed to convert non-PNG images
+except ImportError:
+    Image = None
 
 # Import our chat functionality
-from azure_openai import create_client, get_deployment_name
+from azure_openai import create_client, create_async_client, get_deployment_name
 
 load_dotenv()
 
@@ -20,8 +42,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Simplified CSS for better visibility
-st.markdown("""
+# Simplified CSS for better visibility (whitespace collapsed: it is resent on every rerun)
+_CSS = " ".join("""
 <style>
     .main .block-container {
         padding-top: 1rem;
@@ -92,197 +114,343 @@ st.markdown("""
         margin: 0.25rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+""".split())
+st.markdown(_CSS, unsafe_allow_html=True)
 
 SUPPORTED_TEXT_EXT = {'.txt', '.csv', '.md'}
 SUPPORTED_PDF_EXT = {'.pdf'}  
 SUPPORTED_IMG_EXT = {'.png', '.jpg', '.jpeg'}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+MAX_PDF_PAGES = int(os.environ.get("MAX_PDF_PAGES", "200"))  # pages extracted per PDF upload
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "32"))  # split larger PDFs across processes
+# Parallel extraction is opt-in (PDF_WORKERS >= 2): starting the workers briefly swaps the
+# process-wide __main__, which another session starting at that moment could race with
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "1"))
 
 def load_system_prompt() -> str:
     """Load the system prompt from markdown file."""
     path = os.environ.get("SYSTEM_PROMPT_PATH", "docs/system_prompt.md")
-    if not os.path.exists(path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
         return ("You are an expert Indian Chartered Accountant–style AI Tax Assistant. "
                 "If information is missing ask clarifying questions. End with a disclaimer.")
-    
+    return _parse_system_prompt(path, mtime)
+
+@st.cache_data(show_spinner=False)
+def _parse_system_prompt(path: str, mtime: float) -> str:
+    """Read and trim the prompt file; cached per process, `mtime` invalidates it on edits."""
     with open(path, 'r', encoding='utf-8') as f:
         content = f.read()
     
     # Extract the main system prompt
     marker = "You are an expert Indian Chartered Accountant"
-    if marker in content:
-        seg = content.split(marker, 1)[1]
-        seg = marker + seg
-        for stop in ["CORE OBJECTIVES", "MANDATORY CLARIFYING"]:
-            idx = seg.find(stop)
-            if idx != -1:
-                seg = seg[:idx]
-                break
+    idx = content.find(marker)
+    if idx != -1:
+        seg = content[idx:]
+        # Cut at the first stop marker present (checked in priority order)
+        stop = next((i for i in map(seg.find, ("CORE OBJECTIVES", "MANDATORY CLARIFYING")) if i != -1), -1)
+        if stop != -1:
+            seg = seg[:stop]
         return seg.strip()
     return content[:4000]
 
+@st.cache_resource(show_spinner=False)
+def _get_client():
+    """One AI client (and its connection pool) per process, shared by every session."""
+    return create_client()
+
+@st.cache_resource(show_spinner=False)
+def _get_model() -> str:
+    return get_deployment_name()
+
+@st.cache_resource(show_spinner=False)
+def _get_request_pool() -> ThreadPoolExecutor:
+    """Threads that send streaming requests, so they are in flight while the page is still drawn."""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-request")
+
+@st.cache_resource(show_spinner=False)
+def _get_async_runtime():
+    """Event loop on a daemon thread plus an async AI client bound to it, shared by every session.
+
+    The client's connection pool belongs to this loop, so batches are submitted to it
+    with run_coroutine_threadsafe rather than a fresh asyncio.run per rerun.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="ai-async", daemon=True).start()
+    return loop, create_async_client()
+
+def _upload_key(uploaded_file) -> tuple:
+    """Identity of one upload: the file_id changes whenever the file is uploaded again."""
+    return uploaded_file.name, uploaded_file.size, getattr(uploaded_file, "file_id", None)
+
+def _handle_text(uploaded_file, file_details: Dict[str, Any]) -> Dict[str, Any]:
+    content = uploaded_file.read().decode('utf-8', errors='ignore')
+    return {
+        "type": "text",
+        "name": uploaded_file.name,
+        "content": content,
+        "details": file_details
+    }
+
+# PDFium is not thread-safe and uploads are parsed on a thread pool
+_PDFIUM_LOCK = threading.Lock()
+
+def _pdfium_text(data: bytes) -> str:
+    """Text of the first MAX_PDF_PAGES pages, one page per line block; unreadable pages are skipped.
+
+    Large PDFs are split into page ranges extracted in parallel by the shared process pool
+    (started on the script thread before uploads are parsed) and joined back in page order.
+    Without a working pool they are extracted in-process.
+    """
+    with _PDFIUM_LOCK:
+        n = min(pdf_pages.page_count(data), MAX_PDF_PAGES)
+        if n < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+            return "\n".join(pdf_pages.extract_pages(data, 0, n))
+    texts = pdf_pages.extract_parallel(data, n, PDF_WORKERS)
+    if texts is None:
+        with _PDFIUM_LOCK:
+            texts = pdf_pages.extract_pages(data, 0, n)
+    return "\n".join(texts)
+
+def _pypdf2_text(data: bytes) -> str:
+    pdf_reader = PyPDF2.PdfReader(BytesIO(data))
+    # Pages are read lazily and written straight into one buffer; stop at the page cap
+    buf = StringIO()
+    sep = ""
+    for i, page in enumerate(pdf_reader.pages):
+        if i >= MAX_PDF_PAGES:
+            break
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            continue
+        buf.write(sep)
+        buf.write(text)
+        sep = "\n"
+    return buf.getvalue()
+
+def _handle_pdf(uploaded_file, file_details: Dict[str, Any]) -> Dict[str, Any]:
+    if pdf_pages is not None:
+        content = _pdfium_text(uploaded_file.read())
+    elif PyPDF2 is not None:
+        content = _pypdf2_text(uploaded_file.read())
+    else:
+        return {"error": "No PDF library installed (pypdfium2 or PyPDF2). Cannot process PDF files."}
+    
+    return {
+        "type": "pdf",
+        "name": uploaded_file.name,
+        "content": content,
+        "details": file_details
+    }
+
+def _handle_image(uploaded_file, file_details: Dict[str, Any]) -> Dict[str, Any]:
+    raw = uploaded_file.read()
+    if raw.startswith(_PNG_SIGNATURE):
+        # Already PNG: encode the uploaded bytes as-is instead of decoding and re-saving
+        img_str = base64.b64encode(raw).decode()
+    else:
+        if Image is None:
+            return {"error": "PIL not installed. Cannot process image files."}
+        image = Image.open(BytesIO(raw))
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        img_str = base64.b64encode(buffered.getvalue()).decode()
+    
+    return {
+        "type": "image",
+        "name": uploaded_file.name,
+        "content": img_str,
+        "details": file_details
+    }
+
+# File extension -> handler
+_HANDLERS = {
+    **dict.fromkeys(SUPPORTED_TEXT_EXT, _handle_text),
+    **dict.fromkeys(SUPPORTED_PDF_EXT, _handle_pdf),
+    **dict.fromkeys(SUPPORTED_IMG_EXT, _handle_image),
+}
+
 def process_uploaded_file(uploaded_file) -> Dict[str, Any]:
-    """Process an uploaded file and extract content."""
-    file_details = {"name": uploaded_file.name, "size": uploaded_file.size}
+    """Process an uploaded file and extract content.
+
+    Runs on worker threads, so failures are returned as {"error": message} for the caller
+    to show with st.error instead of calling Streamlit from here.
+    """
     file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-    
+    handler = _HANDLERS.get(file_ext)
+    if handler is None:
+        return {"error": f"Unsupported file type: {file_ext}"}
     try:
-        if file_ext in SUPPORTED_TEXT_EXT:
-            content = uploaded_file.read().decode('utf-8', errors='ignore')
-            return {
-                "type": "text",
-                "name": uploaded_file.name,
-                "content": content,
-                "details": file_details
-            }
-        elif file_ext in SUPPORTED_PDF_EXT:
-            try:
-                import PyPDF2
-                from io import BytesIO
-                
-                pdf_reader = PyPDF2.PdfReader(BytesIO(uploaded_file.read()))
-                text_parts = []
-                for page in pdf_reader.pages:
-                    try:
-                        text_parts.append(page.extract_text() or "")
-                    except Exception:
-                        pass
-                
-                return {
-                    "type": "pdf",
-                    "name": uploaded_file.name,
-                    "content": "\n".join(text_parts),
-                    "details": file_details
-                }
-            except ImportError:
-                st.error("PyPDF2 not installed. Cannot process PDF files.")
-                return None
-        elif file_ext in SUPPORTED_IMG_EXT:
-            try:
-                from PIL import Image
-                from io import BytesIO
-                
-                image = Image.open(BytesIO(uploaded_file.read()))
-                buffered = BytesIO()
-                image.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-                
-                return {
-                    "type": "image",
-                    "name": uploaded_file.name,
-                    "content": img_str,
-                    "details": file_details
-                }
-            except ImportError:
-                st.error("PIL not installed. Cannot process image files.")
-                return None
-        else:
-            st.error(f"Unsupported file type: {file_ext}")
-            return None
+        return handler(uploaded_file, {"name": uploaded_file.name, "size": uploaded_file.size})
     except Exception as e:
-        st.error(f"Error processing {uploaded_file.name}: {str(e)}")
-        return None
+        return {"error": f"Error processing {uploaded_file.name}: {str(e)}"}
+
+_ATTACHMENTS_HEADER = ("--- ATTACHED DOCUMENTS FOR ANALYSIS ---\n"
+                       "Please extract specific values from these documents and use them in your analysis:")
+# Stands in for the documents in each user turn; their text is sent once, in the system message
+_ATTACHMENTS_NOTE = ("\n📎 {n} attached document(s) are included under ATTACHED DOCUMENTS FOR ANALYSIS "
+                     "in the system message. Extract specific values from them and use them in your analysis.")
+
+_CRITICAL_INSTRUCTIONS = "\n".join([
+    "\n🎯 **CRITICAL INSTRUCTIONS:**",
+    "1. EXTRACT specific numerical values from the attached documents (salary amounts, deductions, TDS, etc.)",
+    "2. USE these actual values in your calculations and regime comparisons",
+    "3. CREATE detailed tables showing calculations based on the provided data",
+    "4. PROVIDE personalized recommendations based on the specific numbers found",
+    "5. If user says they don't have additional information, work with available data and make reasonable assumptions",
+    "6. ALWAYS prompt for missing key information that would improve the analysis (investments, rent, dependents, etc.)",
+    "7. Ask clarifying questions about: HRA eligibility, metro/non-metro city, health insurance premiums, existing investments",
+    "8. For comprehensive analysis, inquire about: previous year returns, investment goals, risk appetite, family situation",
+])
+
+# Query keywords -> follow-up block appended to the user message, in output order
+_PROMPT_BLOCKS = (
+    (("form 16", "salary"), "\n".join([
+        "\n📋 **FOR FORM 16/SALARY ANALYSIS - PROMPT FOR:**",
+        "- Current city (metro/non-metro) for HRA calculation",
+        "- Rent amount and duration if claiming HRA",
+        "- Health insurance premiums (self, parents, senior citizens)",
+        "- Existing investments (EPF, PPF, ELSS, NSC, etc.)",
+        "- Education loan interest payments",
+        "- Charitable donations made",
+    ])),
+    (("regime", "compare"), "\n".join([
+        "\n⚖️ **FOR REGIME COMPARISON - PROMPT FOR:**",
+        "- Complete list of current deductions and investments",
+        "- Future investment plans and capacity",
+        "- Risk tolerance and investment preferences",
+        "- Long-term financial goals",
+    ])),
+    (("investment", "planning"), "\n".join([
+        "\n💰 **FOR INVESTMENT PLANNING - PROMPT FOR:**",
+        "- Current age and retirement timeline",
+        "- Risk appetite (conservative/moderate/aggressive)",
+        "- Emergency fund status",
+        "- Dependents and their insurance needs",
+        "- Existing portfolio and performance",
+    ])),
+    (("hra", "house"), "\n".join([
+        "\n🏠 **FOR HRA ANALYSIS - PROMPT FOR:**",
+        "- Current residential city classification",
+        "- Monthly rent amount and rental agreement details",
+        "- Landlord's PAN details",
+        "- Own house ownership status",
+        "- Home loan EMI if applicable",
+    ])),
+)
+
+_LIMITED_INFO_PHRASES = ("don't have", "not have", "no additional", "missing", "unavailable")
+_LIMITED_INFO_BLOCK = ("\n⚠️ **USER INDICATED LIMITED INFORMATION AVAILABLE**\n"
+                       "The user has indicated they don't have additional information. "
+                       "Proceed with analysis using available data and make reasonable assumptions.")
+
+@lru_cache(maxsize=2)
+def _fy_for(d: date) -> Tuple[str, str]:
+    """(current FY, previous FY) for the given date; the Indian FY runs April to March."""
+    start = d.year if d.month >= 4 else d.year - 1
+    return f"{start}-{start + 1}", f"{start - 1}-{start}"
+
+# Sidebar analyses: button label -> prompt, shown under the section headers below
+_ANALYSIS_PROMPTS = {
+    "📊 Analyze Form 16 Part A & B": "Please provide a comprehensive analysis of my Form 16 including:\n1. Part A (TDS Certificate) analysis\n2. Part B (Computation of Income) breakdown\n3. Salary components (Basic, HRA, Allowances, Perquisites)\n4. All deductions claimed (Section 16, 80C, 80D, etc.)\n5. Tax computation and TDS details\n6. Insights and optimization opportunities",
+    "📈 Salary Breakdown Analysis": "Break down my salary structure in detail:\n1. Basic salary, allowances (HRA, LTA, Medical, etc.)\n2. Perquisites and their tax implications\n3. Bonus, commissions, and variable pay\n4. Section 10 exemptions available (HRA, LTA, gratuity)\n5. Standard deduction and professional tax\n6. Recommendations for salary restructuring",
+    "🆚 Old vs New Regime Comparison": "Provide a detailed comparison of Old vs New tax regime for my situation:\n1. Tax calculation under both regimes\n2. Available deductions in each regime\n3. Net tax liability comparison\n4. Take-home salary impact\n5. Which regime is better and why?\n6. Multi-year projection and recommendations",
+    "🎯 Complete Deduction Analysis": "Analyze all possible deductions for my situation:\n1. Section 80C investments (EPF, PPF, ELSS, Insurance)\n2. Section 80D health insurance premiums\n3. Section 80E education loan interest\n4. Section 80G charitable donations\n5. Other applicable deductions (80TTA, 24b, etc.)\n6. Unused deduction limits and recommendations",
+    "📊 Investment Recommendations": "Suggest optimal investment strategy based on my profile:\n1. Tax-saving investments for immediate benefit\n2. Long-term wealth creation options\n3. Risk-appropriate portfolio allocation\n4. Emergency fund recommendations\n5. Insurance needs analysis\n6. Timeline-based investment planning",
+    "� Tax Liability Assessment": "Calculate my complete tax assessment:\n1. Total taxable income computation\n2. Tax liability under applicable slabs\n3. TDS vs actual tax liability\n4. Refund due or additional tax payable\n5. Advance tax planning for next year\n6. ITR filing guidance and timeline",
+}
+
+_SIDEBAR_SECTIONS = (
+    ("**📋 Form 16 Analysis:**", ("📊 Analyze Form 16 Part A & B", "📈 Salary Breakdown Analysis")),
+    ("**⚖️ Tax Regime Analysis:**", ("🆚 Old vs New Regime Comparison",)),
+    ("**💰 Investment & Tax Planning:**", ("🎯 Complete Deduction Analysis", "📊 Investment Recommendations")),
+    ("**📋 Tax Assessment:**", ("� Tax Liability Assessment",)),
+)
+
+# Welcome screen: (section header, ((button label, question), ...)), four buttons per row
+_WELCOME_SECTIONS = (
+    ("**📋 Form 16 & Document Analysis:**", (
+        ("📊 Form 16 Analysis", "Provide comprehensive Form 16 analysis including Part A & B breakdown, salary components, deductions, and tax computation with optimization suggestions."),
+        ("⚖️ Tax Regime Compare", "Compare old vs new tax regime for my specific situation. Show detailed calculations, tax liability, and recommend the better option with reasoning."),
+        ("💰 Tax Assessment", "Calculate my complete tax assessment: total taxable income, tax liability, TDS analysis, refund/payment due, and next year planning."),
+        ("📈 Salary Breakdown", "Analyze my salary structure in detail: basic salary, allowances, perquisites, exemptions, deductions, and restructuring recommendations."),
+    )),
+    ("**💡 Investment & Tax Planning:**", (
+        ("🎯 Deduction Analysis", "Analyze all possible deductions (80C, 80D, 80E, 80G, etc.) for my situation, show unused limits, and recommend optimal utilization."),
+        ("� Investment Guide", "Recommend optimal investment strategy based on my profile: tax-saving options, wealth creation, risk allocation, and timeline-based planning."),
+        ("🏠 HRA Optimization", "Analyze my HRA situation: exemption calculation, rent vs ownership benefits, metro/non-metro impact, and optimization strategies."),
+        ("🔮 Next Year Planning", "Create next year tax planning strategy: investment recommendations, salary restructuring, advance tax planning, and timeline for actions."),
+    )),
+)
+
+def _fmt_file(i: int, file_data: Dict[str, Any]) -> str:
+    """Message section for the i-th attached document."""
+    if file_data['type'] in {"text", "pdf"}:
+        full = file_data['content']
+        n = len(full)
+        # Limit content length; short documents are used as-is without copying
+        content = full if n <= 4000 else full[:4000] + "\n... (content truncated for brevity)"
+        return (f"\n📄 **Document {i}: {file_data['name']}** ({file_data['type']}, {n} chars):\n"
+                f"```\n{content}\n```")
+    return f"\n🖼️ **Document {i}: {file_data['name']}** ({file_data['type']}): Image file attached (base64 encoded)"
+
+def documents_context(files: List[Dict[str, Any]]) -> str:
+    """The attached documents as one block, appended to the system prompt for every request."""
+    return "\n".join([_ATTACHMENTS_HEADER, *(_fmt_file(i, file_data) for i, file_data in enumerate(files, 1))])
 
 def build_message_with_files(user_input: str, files: List[Dict[str, Any]]) -> str:
-    """Build user message including file contents."""
-    # Get current financial year info
-    current_date = datetime.now()
-    if current_date.month >= 4:  # April to March is Indian FY
-        current_fy = f"{current_date.year}-{current_date.year + 1}"
-        previous_fy = f"{current_date.year - 1}-{current_date.year}"
-    else:
-        current_fy = f"{current_date.year - 1}-{current_date.year}"
-        previous_fy = f"{current_date.year - 2}-{current_date.year - 1}"
-    
-    parts = [f"User Question: {user_input.strip()}"]
-    parts.append(f"Current Financial Year: {current_fy}")
-    parts.append(f"If no specific financial year is mentioned in documents or questions, assume {previous_fy} (previous FY).")
-    
+    """Build the user message: question, FY context and instructions; files are referenced, not inlined."""
+    current_fy, previous_fy = _fy_for(datetime.now().date())
+    parts = [
+        f"User Question: {user_input.strip()}\n"
+        f"Current Financial Year: {current_fy}\n"
+        f"If no specific financial year is mentioned in documents or questions, assume {previous_fy} (previous FY)."
+    ]
     if files:
-        parts.append("\n--- ATTACHED DOCUMENTS FOR ANALYSIS ---")
-        parts.append("Please extract specific values from these documents and use them in your analysis:")
-        for i, file_data in enumerate(files, 1):
-            if file_data['type'] in {"text", "pdf"}:
-                content = file_data['content'][:4000]  # Limit content length
-                if len(file_data['content']) > 4000:
-                    content += "\n... (content truncated for brevity)"
-                parts.append(f"\n📄 **Document {i}: {file_data['name']}** ({file_data['type']}, {len(file_data['content'])} chars):")
-                parts.append(f"```\n{content}\n```")
-            else:
-                parts.append(f"\n🖼️ **Document {i}: {file_data['name']}** ({file_data['type']}): Image file attached (base64 encoded)")
-    
-    parts.append("\n🎯 **CRITICAL INSTRUCTIONS:**")
-    parts.append("1. EXTRACT specific numerical values from the attached documents (salary amounts, deductions, TDS, etc.)")
-    parts.append("2. USE these actual values in your calculations and regime comparisons")
-    parts.append("3. CREATE detailed tables showing calculations based on the provided data")
-    parts.append("4. PROVIDE personalized recommendations based on the specific numbers found")
-    parts.append("5. If user says they don't have additional information, work with available data and make reasonable assumptions")
-    parts.append("6. ALWAYS prompt for missing key information that would improve the analysis (investments, rent, dependents, etc.)")
-    parts.append("7. Ask clarifying questions about: HRA eligibility, metro/non-metro city, health insurance premiums, existing investments")
-    parts.append("8. For comprehensive analysis, inquire about: previous year returns, investment goals, risk appetite, family situation")
+        parts.append(_ATTACHMENTS_NOTE.format(n=len(files)))
+    parts.append(_CRITICAL_INSTRUCTIONS)
     
     # Add specific prompting strategies based on the query type
     user_input_lower = user_input.lower()
-    
-    if "form 16" in user_input_lower or "salary" in user_input_lower:
-        parts.append("\n📋 **FOR FORM 16/SALARY ANALYSIS - PROMPT FOR:**")
-        parts.append("- Current city (metro/non-metro) for HRA calculation")
-        parts.append("- Rent amount and duration if claiming HRA")
-        parts.append("- Health insurance premiums (self, parents, senior citizens)")
-        parts.append("- Existing investments (EPF, PPF, ELSS, NSC, etc.)")
-        parts.append("- Education loan interest payments")
-        parts.append("- Charitable donations made")
-    
-    if "regime" in user_input_lower or "compare" in user_input_lower:
-        parts.append("\n⚖️ **FOR REGIME COMPARISON - PROMPT FOR:**")
-        parts.append("- Complete list of current deductions and investments")
-        parts.append("- Future investment plans and capacity")
-        parts.append("- Risk tolerance and investment preferences")
-        parts.append("- Long-term financial goals")
-    
-    if "investment" in user_input_lower or "planning" in user_input_lower:
-        parts.append("\n💰 **FOR INVESTMENT PLANNING - PROMPT FOR:**")
-        parts.append("- Current age and retirement timeline")
-        parts.append("- Risk appetite (conservative/moderate/aggressive)")
-        parts.append("- Emergency fund status")
-        parts.append("- Dependents and their insurance needs")
-        parts.append("- Existing portfolio and performance")
-    
-    if "hra" in user_input_lower or "house" in user_input_lower:
-        parts.append("\n🏠 **FOR HRA ANALYSIS - PROMPT FOR:**")
-        parts.append("- Current residential city classification")
-        parts.append("- Monthly rent amount and rental agreement details")
-        parts.append("- Landlord's PAN details")
-        parts.append("- Own house ownership status")
-        parts.append("- Home loan EMI if applicable")
+    parts.extend(block for keywords, block in _PROMPT_BLOCKS if any(k in user_input_lower for k in keywords))
     
     # Check if user is indicating they don't have additional information
-    user_input_lower = user_input.lower()
-    if any(phrase in user_input_lower for phrase in ["don't have", "not have", "no additional", "missing", "unavailable"]):
-        parts.append("\n⚠️ **USER INDICATED LIMITED INFORMATION AVAILABLE**")
-        parts.append("The user has indicated they don't have additional information. Proceed with analysis using available data and make reasonable assumptions.")
+    if any(phrase in user_input_lower for phrase in _LIMITED_INFO_PHRASES):
+        parts.append(_LIMITED_INFO_BLOCK)
     
     return "\n".join(parts)
 
-def call_model(client, model: str, system_prompt: str, messages: List[Dict[str, str]]) -> str:
-    """Call the AI model with the conversation."""
+def _model_messages(system_prompt: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """System prompt plus role/content of each message; history entries also carry UI-only fields."""
+    return [{"role": "system", "content": system_prompt}] + [{"role": m["role"], "content": m["content"]} for m in messages]
+
+def _response_key(model: str, full_messages: List[Dict[str, str]]) -> str:
+    """Hash of everything that determines the (temperature 0) model output."""
+    payload = json.dumps([model, full_messages], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _response_cache() -> Dict[str, str]:
+    """Per-session answers keyed by _response_key; emptied by New Chat."""
+    return st.session_state.setdefault("_resp_cache", {})
+
+def _show_debug(full_messages: List[Dict[str, str]], messages: List[Dict[str, str]]) -> None:
+    # Debug: Show what we're sending to the model (optional)
+    if st.session_state.get('debug_mode', False):
+        with st.expander("🔍 Debug: Messages sent to AI"):
+            st.json({"message_count": len(full_messages), "last_user_message_preview": messages[-1]["content"][:500] if messages else "None"})
+
+def _complete(client, model: str, full_messages: List[Dict[str, str]]) -> str:
+    """Blocking completion, falling back to the responses API; raises the first error if both fail."""
     try:
-        full_messages = [{"role": "system", "content": system_prompt}] + messages
-        
-        # Debug: Show what we're sending to the model (optional)
-        if st.session_state.get('debug_mode', False):
-            with st.expander("🔍 Debug: Messages sent to AI"):
-                st.json({"message_count": len(full_messages), "last_user_message_preview": messages[-1]["content"][:500] if messages else "None"})
-        
         resp = client.chat.completions.create(
             model=model,
             temperature=0,
             messages=full_messages,
             max_tokens=1200
         )
-        
         return resp.choices[0].message.content
-        
     except Exception as e:
         try:
             # Fallback for different API versions
@@ -293,31 +461,336 @@ def call_model(client, model: str, system_prompt: str, messages: List[Dict[str,
                 max_output_tokens=1200
             )
             return resp.output_text
+        except Exception:
+            raise e
+
+def _system_prompt() -> str:
+    """System prompt plus the currently attached documents.
+
+    Documents travel here once per request instead of inside every user turn, so follow-up
+    questions don't resend them and the prompt prefix stays stable for provider-side caching.
+    """
+    files = st.session_state.uploaded_files
+    if not files:
+        return st.session_state.system_prompt
+    return st.session_state.system_prompt + "\n\n" + documents_context(files)
+
+def _user_entry(question: str, content: str) -> Dict[str, Any]:
+    """User history entry: "content" goes to the model, "display"/"attachment_count" are what the chat shows."""
+    return {"role": "user", "content": content, "display": question.strip(), "attachment_count": len(st.session_state.uploaded_files)}
+
+def _quick_action_entry(prompt: str) -> Dict[str, Any]:
+    files = st.session_state.uploaded_files
+    return _user_entry(prompt, build_message_with_files(prompt, files) if files else prompt)
+
+def _run_quick_action(prompt: str) -> None:
+    """Queue one canned question (with any attached files); the pending-response block streams the answer.
+
+    Clicking the same action again before it is answered doesn't queue it twice.
+    """
+    entry = _quick_action_entry(prompt)
+    messages = st.session_state.messages
+    if messages and messages[-1]["role"] == "user" and messages[-1]["content"] == entry["content"]:
+        return
+    messages.append(entry)
+
+def _close_opened(opened: Future) -> None:
+    if not opened.cancelled() and opened.exception() is None:
+        opened.result().close()
+
+class _ReplyStream:
+    """Iterator over the pieces of one answer, as returned by stream_model.
+
+    close() also releases a request that was sent but never read: a generator that was
+    never started skips its own cleanup, so the stream is closed once the request returns.
+    """
+    def __init__(self, pieces: Iterator[str], opened: Optional[Future]):
+        self._pieces = pieces
+        self._opened = opened
+
+    def __iter__(self) -> "_ReplyStream":
+        return self
+
+    def __next__(self) -> str:
+        self._opened = None  # the generator owns the stream from its first step
+        return next(self._pieces)
+
+    def close(self) -> None:
+        if self._opened is not None:
+            self._opened.cancel()
+            self._opened.add_done_callback(_close_opened)
+            self._opened = None
+        self._pieces.close()
+
+def stream_model(client, model: str, system_prompt: str, messages: List[Dict[str, str]]) -> _ReplyStream:
+    """Answer the conversation, yielding the text in pieces as the model generates it.
+
+    The request is sent as soon as this is called (on a helper thread), so its round trip
+    overlaps whatever the caller draws before it starts iterating. If the stream cannot be
+    opened the blocking call is tried instead and its answer yielded whole. The complete
+    answer is added to the response cache at the end.
+    """
+    cache = _response_cache()
+    full_messages = _model_messages(system_prompt, messages)
+    key = _response_key(model, full_messages)
+    opened = None
+    if key not in cache:
+        opened = _get_request_pool().submit(
+            client.chat.completions.create,
+            model=model,
+            temperature=0,
+            messages=full_messages,
+            max_tokens=1200,
+            stream=True
+        )
+
+    def deltas() -> Iterator[str]:
+        if opened is None:
+            yield cache[key]
+            return
+        _show_debug(full_messages, messages)
+        parts = []
+        try:
+            stream = opened.result()
+            try:
+                for chunk in stream:
+                    # Azure sends chunks with no choices (e.g. content filter results)
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # Also reached when the reply is abandoned mid-stream (a click reruns the
+                # script), so the model stops generating an answer nobody will see
+                stream.close()
+        except Exception as e:
+            if parts:
+                yield f"\n\n❌ Error calling AI model: {str(e)}"
+                return
+            try:
+                parts.append(_complete(client, model, full_messages))
+            except Exception:
+                yield f"❌ Error calling AI model: {str(e)}"
+                return
+            yield parts[0]
+        cache[key] = "".join(parts)
+
+    return _ReplyStream(deltas(), opened)
+
+# Redraw the streaming answer at most every 50 ms and only once 8 new chars have arrived:
+# each redraw re-parses the in-progress markdown in the browser
+STREAM_FLUSH_INTERVAL_S = 0.05
+STREAM_FLUSH_MIN_CHARS = 8
+
+def _stable_prefix_len(text: str) -> int:
+    """Length of the leading part of text made of finished blocks.
+
+    A block is finished at a blank line that is not inside an open ``` fence; 0 if none.
+    """
+    cut = 0
+    i = text.find("\n\n")
+    while i != -1:
+        if text.count("```", 0, i) % 2 == 0:
+            cut = i + 2
+        i = text.find("\n\n", i + 2)
+    return cut
+
+def stream_reply(deltas: _ReplyStream) -> Dict[str, str]:
+    """Show the answer from stream_model as it streams in, then replace it with the cleaned-up version.
+
+    Everything is drawn into one placeholder, so the bubble is updated in place and the
+    final text replaces the streamed one rather than being drawn a second time. While
+    streaming, finished paragraphs and code blocks are frozen in their own element and
+    only the block still being written is redrawn, so long answers don't get slower.
+    Returns the assistant history entry: raw "content" for the model, "rendered" for display.
+    """
+    placeholder = st.empty()
+    blocks = placeholder.container()
+    slot = blocks.empty()  # holds the block being written
+    buf = []
+    tail = ""  # text not yet frozen into a finished block
+    pending = 0  # chars received since the last redraw
+    last_flush = 0.0  # so the first 8 chars are shown immediately
+    try:
+        for delta in deltas:
+            buf.append(delta)
+            tail += delta
+            pending += len(delta)
+            now = time.monotonic()
+            if pending >= STREAM_FLUSH_MIN_CHARS and now - last_flush >= STREAM_FLUSH_INTERVAL_S:
+                cut = _stable_prefix_len(tail)
+                if cut:
+                    slot.markdown(tail[:cut])
+                    slot = blocks.empty()
+                    tail = tail[cut:]
+                slot.markdown(tail)
+                pending = 0
+                last_flush = now
+    finally:
+        # A rerun raised from inside the st calls above closes the model stream right away
+        deltas.close()
+    response = "".join(buf)
+    rendered = clean_and_format_response(response)
+    placeholder.markdown(rendered)
+    return {"role": "assistant", "content": response, "rendered": rendered}
+
+async def call_model_async(client, model: str, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+    """Async counterpart of _complete for concurrent batches; errors come back as text (no Streamlit calls)."""
+    full_messages = _model_messages(system_prompt, messages)
+    try:
+        resp = await client.chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=full_messages,
+            max_tokens=1200
+        )
+        return resp.choices[0].message.content
+    except Exception as e:
+        try:
+            resp = await client.responses.create(
+                model=model,
+                input=full_messages,
+                temperature=0,
+                max_output_tokens=1200
+            )
+            return resp.output_text
         except Exception:
             return f"❌ Error calling AI model: {str(e)}"
 
+MAX_CONCURRENT_ANALYSES = 4
+
+async def _gather_analyses(client, model: str, system_prompt: str, conversations: List[List[Dict[str, str]]]) -> List[str]:
+    sem = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+    async def one(messages):
+        async with sem:
+            return await call_model_async(client, model, system_prompt, messages)
+    return await asyncio.gather(*(one(m) for m in conversations))
+
+def run_analyses(model: str, system_prompt: str, conversations: List[List[Dict[str, str]]]) -> List[str]:
+    """Answer several independent conversations concurrently; results keep input order.
+
+    Conversations already answered this session are served from the response cache.
+    """
+    cache = _response_cache()
+    keys = [_response_key(model, _model_messages(system_prompt, m)) for m in conversations]
+    results = [cache.get(k) for k in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if todo:
+        loop, client = _get_async_runtime()
+        fresh = asyncio.run_coroutine_threadsafe(
+            _gather_analyses(client, model, system_prompt, [conversations[i] for i in todo]), loop
+        ).result()
+        for i, response in zip(todo, fresh):
+            results[i] = response
+            if response and not response.startswith("❌"):  # don't pin errors
+                cache[keys[i]] = response
+    return results
+
+# Messages sent verbatim to the model each turn; older turns are replaced by a rolling summary
+MODEL_HISTORY_MESSAGES = int(os.environ.get("MODEL_HISTORY_MESSAGES", "12"))
+
+_SUMMARY_PROMPT = (
+    "Summarize this tax consultation for your own reference in later turns. Keep every figure, "
+    "income source, deduction, regime preference, document detail and open question the user "
+    "mentioned, and the conclusions already given. Plain text, at most 200 words."
+)
+
+async def _summarize_async(client, model: str, previous: str, messages: List[Dict[str, Any]]) -> str:
+    """Fold messages into the previous summary (no Streamlit calls)."""
+    # Users' questions without the instruction scaffolding wrapped around them
+    transcript = "\n\n".join(
+        f"User: {m.get('display', m['content'])}" if m["role"] == "user" else f"Assistant: {m['content']}"
+        for m in messages
+    )
+    if previous:
+        transcript = f"Summary so far:\n{previous}\n\nLater conversation:\n{transcript}"
+    resp = await client.chat.completions.create(
+        model=model,
+        temperature=0,
+        messages=[{"role": "system", "content": _SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+        max_tokens=400
+    )
+    return resp.choices[0].message.content
+
+def _history_window(system_prompt: str, messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """System prompt and messages to send: the last MODEL_HISTORY_MESSAGES verbatim, older ones as a summary.
+
+    The summary is built in the background on the async runtime and only used once ready;
+    until then the messages it will cover are still sent verbatim, so nothing is dropped.
+    A new summary is started each time another MODEL_HISTORY_MESSAGES have left the window.
+    """
+    covered, summary = st.session_state.get("_summary", (0, ""))
+    job = st.session_state.get("_summary_job")
+    if job and job[1].done():
+        del st.session_state["_summary_job"]
+        try:
+            covered, summary = job[0], job[1].result()
+        except Exception:
+            pass  # keep the previous summary; the next turn starts another
+        else:
+            st.session_state["_summary"] = (covered, summary)
+        job = None
+    # Start the window on a user turn
+    cut = max(len(messages) - MODEL_HISTORY_MESSAGES, 0)
+    while cut < len(messages) - 1 and messages[cut]["role"] != "user":
+        cut += 1
+    if job is None and cut - covered >= MODEL_HISTORY_MESSAGES:
+        loop, client = _get_async_runtime()
+        future = asyncio.run_coroutine_threadsafe(_summarize_async(client, _get_model(), summary, messages[covered:cut]), loop)
+        st.session_state["_summary_job"] = (cut, future)
+    if summary:
+        system_prompt += "\n\nSummary of the earlier conversation:\n" + summary
+    return system_prompt, messages[min(covered, cut):]
+
+# Patterns used by clean_and_format_response, compiled once at import
+_PIPE_ONLY = re.compile(r'^\s*\|{10,}\s*$')
+_DASHES = re.compile(r'^-+$')
+# Anything the per-line pass would change outside table rows: whitespace other than single
+# spaces and newlines, doubled or edge spaces, and blank lines (which are dropped)
+_NEEDS_CLEANUP = re.compile(r'[^\S \n]| {2}|^ | $|^$', re.MULTILINE)
+
+def _normalize_pipe_row(line: str) -> str:
+    """Rebuild a table row as '| a | b |' with trimmed cells; rows with fewer than 2 cells are returned as-is.
+
+    Empty cells before the first non-empty one are skipped. A trailing empty cell is dropped
+    only when the row starts without a pipe (it would make the row one cell too wide).
+    """
+    cells = [part.strip() for part in line.split('|')]
+    for start, cell in enumerate(cells):
+        if cell:
+            break
+    else:
+        return line
+    end = len(cells) - 1 if start == 0 and not cells[-1] else len(cells)
+    if end - start < 2:
+        return line
+    return '| ' + ' | '.join(cells[start:end]) + ' |'
+
 def clean_and_format_response(response: str) -> str:
     """Clean and format AI response for better display in Streamlit."""
     if not response:
         return response
     
-    import re
+    # Fast path: with fewer than 3 pipes no line can be a table row, so a response that
+    # passes this one scan would come back unchanged
+    if response.count('|') < 3 and not _NEEDS_CLEANUP.search(response):
+        return response
     
     # Split into lines for processing
     lines = response.split('\n')
     formatted_lines = []
     
     for line in lines:
-        # Skip lines that are just excessive pipe characters
-        if re.match(r'^\s*\|{10,}\s*$', line):
-            continue
-            
-        # If line has too many pipes (malformed table), try to fix it
         if '|' in line:
+            # Skip lines that are just excessive pipe characters
+            if _PIPE_ONLY.match(line):
+                continue
+            
+            # If line has too many pipes (malformed table), try to fix it
             pipe_count = line.count('|')
             if pipe_count > 15:  # Likely malformed
                 # Extract meaningful text between pipes
-                parts = [part.strip() for part in line.split('|') if part.strip() and not re.match(r'^-+$', part.strip())]
+                parts = [part.strip() for part in line.split('|') if part.strip() and not _DASHES.match(part.strip())]
                 if parts and len(parts) <= 6:  # Reasonable number of columns
                     # Reconstruct as proper table row
                     line = '| ' + ' | '.join(parts) + ' |'
@@ -325,40 +798,30 @@ def clean_and_format_response(response: str) -> str:
                     # Skip this malformed line
                     continue
             elif pipe_count >= 3:  # Looks like a table
-                # Clean up spacing in table
-                parts = line.split('|')
-                cleaned_parts = []
-                for part in parts:
-                    cleaned_part = part.strip()
-                    # Skip empty parts at start/end
-                    if cleaned_part or (len(cleaned_parts) > 0 and len(cleaned_parts) < len(parts) - 1):
-                        cleaned_parts.append(cleaned_part)
-                
-                if len(cleaned_parts) > 1:
-                    line = '| ' + ' | '.join(cleaned_parts) + ' |'
+                line = _normalize_pipe_row(line)
         
-        # Clean up whitespace
-        line = re.sub(r'\s+', ' ', line).strip()
+        # Clean up whitespace: collapse runs to one space and trim, in a single pass
+        line = ' '.join(line.split())
         
         if line:  # Only add non-empty lines
             formatted_lines.append(line)
     
-    formatted_response = '\n'.join(formatted_lines)
-    
-    # Final cleanup
-    formatted_response = re.sub(r'\n{3,}', '\n\n', formatted_response)  # Remove excessive newlines
-    
-    return formatted_response
+    # Blank lines were dropped above, so there are no runs of newlines left to squeeze
+    return '\n'.join(formatted_lines)
 
 # Initialize session state
+# The history stays here: session state is held by reference between reruns (it is only
+# pickled when runner.enforceSerializableSessionState is on) and is freed with the session,
+# which a process-wide store keyed by session id would not be
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'uploaded_files' not in st.session_state:
     st.session_state.uploaded_files = []
-if 'client' not in st.session_state:
+if 'system_prompt' not in st.session_state:
     try:
-        st.session_state.client = create_client()
-        st.session_state.model = get_deployment_name()
+        # Fail fast on bad configuration; call sites use the shared cached client and model
+        _get_client()
+        _get_model()
         st.session_state.system_prompt = load_system_prompt()
     except Exception as e:
         st.error(f"Failed to initialize AI client: {e}")
@@ -388,10 +851,23 @@ with st.sidebar:
     
     # Process uploaded files
     if uploaded_files:
+        # Reruns reuse earlier results; only new uploads are parsed (in parallel, Streamlit
+        # calls stay on this thread). Entries for removed uploads are dropped.
+        cache = st.session_state.setdefault("_processed", {})
+        keys = [_upload_key(f) for f in uploaded_files]
+        new = [(k, f) for k, f in zip(keys, uploaded_files) if k not in cache]
+        if new:
+            if pdf_pages is not None and PDF_WORKERS >= 2 and any(os.path.splitext(f.name)[1].lower() in SUPPORTED_PDF_EXT for _, f in new):
+                # Worker processes must be spawned from this thread (see pdf_pages.make_pool)
+                pdf_pages.ensure_pool(PDF_WORKERS)
+            with ThreadPoolExecutor(max_workers=min(8, len(new))) as pool:
+                cache.update(zip((k for k, _ in new), pool.map(process_uploaded_file, (f for _, f in new))))
+        st.session_state._processed = cache = {k: cache[k] for k in keys}
         processed_files = []
-        for uploaded_file in uploaded_files:
-            processed_file = process_uploaded_file(uploaded_file)
-            if processed_file:
+        for processed_file in cache.values():
+            if "error" in processed_file:
+                st.error(processed_file["error"])
+            else:
                 processed_files.append(processed_file)
         st.session_state.uploaded_files = processed_files
     
@@ -408,76 +884,22 @@ with st.sidebar:
     # Enhanced Quick Actions with comprehensive tax scenarios
     # st.markdown("### 🚀 Comprehensive Tax Analysis")
     
-    # Form 16 Analysis Section
-    st.markdown("**📋 Form 16 Analysis:**")
-    
-    if st.button("📊 Analyze Form 16 Part A & B", use_container_width=True):
-        prompt = "Please provide a comprehensive analysis of my Form 16 including:\n1. Part A (TDS Certificate) analysis\n2. Part B (Computation of Income) breakdown\n3. Salary components (Basic, HRA, Allowances, Perquisites)\n4. All deductions claimed (Section 16, 80C, 80D, etc.)\n5. Tax computation and TDS details\n6. Insights and optimization opportunities"
-        if st.session_state.uploaded_files:
-            st.session_state.messages.append({"role": "user", "content": build_message_with_files(prompt, st.session_state.uploaded_files)})
-        else:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-        response = call_model(st.session_state.client, st.session_state.model, st.session_state.system_prompt, st.session_state.messages)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.rerun()
-    
-    if st.button("📈 Salary Breakdown Analysis", use_container_width=True):
-        prompt = "Break down my salary structure in detail:\n1. Basic salary, allowances (HRA, LTA, Medical, etc.)\n2. Perquisites and their tax implications\n3. Bonus, commissions, and variable pay\n4. Section 10 exemptions available (HRA, LTA, gratuity)\n5. Standard deduction and professional tax\n6. Recommendations for salary restructuring"
-        if st.session_state.uploaded_files:
-            st.session_state.messages.append({"role": "user", "content": build_message_with_files(prompt, st.session_state.uploaded_files)})
-        else:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-        response = call_model(st.session_state.client, st.session_state.model, st.session_state.system_prompt, st.session_state.messages)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.rerun()
-    
-    # Tax Regime Comparison
-    st.markdown("**⚖️ Tax Regime Analysis:**")
-    
-    if st.button("🆚 Old vs New Regime Comparison", use_container_width=True):
-        prompt = "Provide a detailed comparison of Old vs New tax regime for my situation:\n1. Tax calculation under both regimes\n2. Available deductions in each regime\n3. Net tax liability comparison\n4. Take-home salary impact\n5. Which regime is better and why?\n6. Multi-year projection and recommendations"
-        if st.session_state.uploaded_files:
-            st.session_state.messages.append({"role": "user", "content": build_message_with_files(prompt, st.session_state.uploaded_files)})
-        else:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-        response = call_model(st.session_state.client, st.session_state.model, st.session_state.system_prompt, st.session_state.messages)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.rerun()
-    
-    # Investment & Deduction Planning
-    st.markdown("**💰 Investment & Tax Planning:**")
-    
-    if st.button("🎯 Complete Deduction Analysis", use_container_width=True):
-        prompt = "Analyze all possible deductions for my situation:\n1. Section 80C investments (EPF, PPF, ELSS, Insurance)\n2. Section 80D health insurance premiums\n3. Section 80E education loan interest\n4. Section 80G charitable donations\n5. Other applicable deductions (80TTA, 24b, etc.)\n6. Unused deduction limits and recommendations"
-        if st.session_state.uploaded_files:
-            st.session_state.messages.append({"role": "user", "content": build_message_with_files(prompt, st.session_state.uploaded_files)})
-        else:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-        response = call_model(st.session_state.client, st.session_state.model, st.session_state.system_prompt, st.session_state.messages)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.rerun()
-    
-    if st.button("📊 Investment Recommendations", use_container_width=True):
-        prompt = "Suggest optimal investment strategy based on my profile:\n1. Tax-saving investments for immediate benefit\n2. Long-term wealth creation options\n3. Risk-appropriate portfolio allocation\n4. Emergency fund recommendations\n5. Insurance needs analysis\n6. Timeline-based investment planning"
-        if st.session_state.uploaded_files:
-            st.session_state.messages.append({"role": "user", "content": build_message_with_files(prompt, st.session_state.uploaded_files)})
-        else:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-        response = call_model(st.session_state.client, st.session_state.model, st.session_state.system_prompt, st.session_state.messages)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.rerun()
-    
-    # Tax Assessment & Planning
-    st.markdown("**📋 Tax Assessment:**")
-    
-    if st.button("� Tax Liability Assessment", use_container_width=True):
-        prompt = "Calculate my complete tax assessment:\n1. Total taxable income computation\n2. Tax liability under applicable slabs\n3. TDS vs actual tax liability\n4. Refund due or additional tax payable\n5. Advance tax planning for next year\n6. ITR filing guidance and timeline"
-        if st.session_state.uploaded_files:
-            st.session_state.messages.append({"role": "user", "content": build_message_with_files(prompt, st.session_state.uploaded_files)})
-        else:
-            st.session_state.messages.append({"role": "user", "content": prompt})
-        response = call_model(st.session_state.client, st.session_state.model, st.session_state.system_prompt, st.session_state.messages)
-        st.session_state.messages.append({"role": "assistant", "content": response})
+    for header, labels in _SIDEBAR_SECTIONS:
+        st.markdown(header)
+        for label in labels:
+            if st.button(label, use_container_width=True):
+                _run_quick_action(_ANALYSIS_PROMPTS[label])
+                st.rerun()
+    
+    if st.button("🚀 Run All Analyses", use_container_width=True):
+        # Every analysis sees the same history; the calls overlap instead of running back to back
+        user_msgs = [_quick_action_entry(prompt) for prompt in _ANALYSIS_PROMPTS.values()]
+        history = st.session_state.messages
+        system_prompt, window = _history_window(_system_prompt(), history)
+        with st.spinner(f"Running {len(user_msgs)} analyses..."):
+            responses = run_analyses(_get_model(), system_prompt, [window + [m] for m in user_msgs])
+        for user_msg, response in zip(user_msgs, responses):
+            history.extend((user_msg, {"role": "assistant", "content": response, "rendered": clean_and_format_response(response)}))
         st.rerun()
     
     st.markdown("---")
@@ -499,6 +921,8 @@ with st.sidebar:
     
     if st.button("🔄 New Chat", use_container_width=True):
         st.session_state.messages = []
+        for key in ("_resp_cache", "_summary", "_summary_job"):
+            st.session_state.pop(key, None)
         st.rerun()
 
 # Main chat interface - full width
@@ -531,69 +955,14 @@ if not st.session_state.messages:
     st.markdown("I'm your expert CA assistant, ready to analyze your tax documents and provide personalized advice.")
     
     # Enhanced Quick action buttons that work with attachments
-    st.markdown("**📋 Form 16 & Document Analysis:**")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        if st.button("📊 Form 16 Analysis", use_container_width=True):
-            question = "Provide comprehensive Form 16 analysis including Part A & B breakdown, salary components, deductions, and tax computation with optimization suggestions."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    with col2:
-        if st.button("⚖️ Tax Regime Compare", use_container_width=True):
-            question = "Compare old vs new tax regime for my specific situation. Show detailed calculations, tax liability, and recommend the better option with reasoning."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    with col3:
-        if st.button("💰 Tax Assessment", use_container_width=True):
-            question = "Calculate my complete tax assessment: total taxable income, tax liability, TDS analysis, refund/payment due, and next year planning."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    with col4:
-        if st.button("📈 Salary Breakdown", use_container_width=True):
-            question = "Analyze my salary structure in detail: basic salary, allowances, perquisites, exemptions, deductions, and restructuring recommendations."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    st.markdown("**💡 Investment & Tax Planning:**")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        if st.button("🎯 Deduction Analysis", use_container_width=True):
-            question = "Analyze all possible deductions (80C, 80D, 80E, 80G, etc.) for my situation, show unused limits, and recommend optimal utilization."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    with col2:
-        if st.button("� Investment Guide", use_container_width=True):
-            question = "Recommend optimal investment strategy based on my profile: tax-saving options, wealth creation, risk allocation, and timeline-based planning."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    with col3:
-        if st.button("🏠 HRA Optimization", use_container_width=True):
-            question = "Analyze my HRA situation: exemption calculation, rent vs ownership benefits, metro/non-metro impact, and optimization strategies."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
-    
-    with col4:
-        if st.button("🔮 Next Year Planning", use_container_width=True):
-            question = "Create next year tax planning strategy: investment recommendations, salary restructuring, advance tax planning, and timeline for actions."
-            full_message = build_message_with_files(question, st.session_state.uploaded_files)
-            st.session_state.messages.append({"role": "user", "content": full_message})
-            st.rerun()
+    for header, actions in _WELCOME_SECTIONS:
+        st.markdown(header)
+        for col, (label, question) in zip(st.columns(len(actions)), actions):
+            with col:
+                if st.button(label, use_container_width=True):
+                    full_message = build_message_with_files(question, st.session_state.uploaded_files)
+                    st.session_state.messages.append(_user_entry(question, full_message))
+                    st.rerun()
     
     # st.markdown("**📋 Detailed Analysis Options:**")
     
@@ -628,39 +997,42 @@ if not st.session_state.messages:
     st.markdown('</div>', unsafe_allow_html=True)
 
 # Display chat messages
-for message in st.session_state.messages:
+HISTORY_WINDOW = 20  # most recent messages drawn on every rerun; older ones only on request
+
+def render_message(message: Dict[str, Any]) -> None:
     with st.chat_message(message["role"]):
         if message["role"] == "user":
-            # Check if this message contains file attachments
-            content = message["content"]
-            if "--- ATTACHED DOCUMENTS FOR ANALYSIS ---" in content:
-                # Split user question from file content
-                parts = content.split("--- ATTACHED DOCUMENTS FOR ANALYSIS ---", 1)
-                user_question = parts[0].replace("User Question:", "").strip()
-                
-                st.markdown(f"**Question:** {user_question}")
-                if st.session_state.uploaded_files:
-                    st.caption(f"📎 {len(st.session_state.uploaded_files)} document(s) analyzed")
-            else:
-                st.markdown(content)
+            # Show the question only; the attached documents stay in "content" for the model.
+            # Plain text: user input is not markdown and skips the markdown renderer.
+            st.caption("Question")
+            st.text(message["display"])
+            if message["attachment_count"]:
+                st.caption(f"📎 {message['attachment_count']} document(s) analyzed")
         else:
-            st.markdown(message["content"])
+            # Cleaned once when the answer arrived
+            st.markdown(message["rendered"])
+
+# A toggle rather than an expander: expander contents are built and sent even while collapsed
+older = st.session_state.messages[:-HISTORY_WINDOW]
+if older and st.toggle(f"Show {len(older)} earlier messages", key="show_earlier"):
+    for message in older:
+        render_message(message)
+for message in st.session_state.messages[-HISTORY_WINDOW:]:
+    render_message(message)
 
-# Handle pending AI response (when quick actions are clicked)
+# Handle pending AI response (when quick actions are clicked), streamed into the page
 if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
-    # Get AI response for the last user message
-    with st.chat_message("assistant"):
-        with st.spinner("Analyzing your query..."):
-            response = call_model(
-                st.session_state.client,
-                st.session_state.model,
-                st.session_state.system_prompt,
-                st.session_state.messages
-            )
-        
-        st.markdown(clean_and_format_response(response))
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.rerun()  # Rerun to update the display
+    # Get AI response for the last user message; the request goes out before the bubble is drawn
+    system_prompt, window = _history_window(_system_prompt(), st.session_state.messages)
+    deltas = stream_model(_get_client(), _get_model(), system_prompt, window)
+    try:
+        with st.chat_message("assistant"):
+            reply = stream_reply(deltas)
+            # Already drawn above; no rerun needed, the next interaction replays it from history
+            st.session_state.messages.append(reply)
+    finally:
+        # Also if a rerun interrupts before the answer is read
+        deltas.close()
 
 # Chat input
 if prompt := st.chat_input("Ask me anything about Indian taxes..."):
@@ -668,23 +1040,23 @@ if prompt := st.chat_input("Ask me anything about Indian taxes..."):
     full_message = build_message_with_files(prompt, st.session_state.uploaded_files)
     
     # Add user message to chat
-    st.session_state.messages.append({"role": "user", "content": full_message})
-    
-    # Display user message
-    with st.chat_message("user"):
-        st.markdown(f"**Question:** {prompt}")
-        if st.session_state.uploaded_files:
-            st.markdown(f"📎 **{len(st.session_state.uploaded_files)} file(s) attached**")
-    
-    # Get AI response
-    with st.chat_message("assistant"):
-        with st.spinner("Analyzing your query..."):
-            response = call_model(
-                st.session_state.client,
-                st.session_state.model,
-                st.session_state.system_prompt,
-                st.session_state.messages
-            )
+    st.session_state.messages.append(_user_entry(prompt, full_message))
+    
+    # Send the request first so the model is already working while the bubbles are drawn
+    system_prompt, window = _history_window(_system_prompt(), st.session_state.messages)
+    deltas = stream_model(_get_client(), _get_model(), system_prompt, window)
+    try:
+        # Display user message
+        with st.chat_message("user"):
+            st.caption("Question")
+            st.text(prompt)
+            if st.session_state.uploaded_files:
+                st.markdown(f"📎 **{len(st.session_state.uploaded_files)} file(s) attached**")
         
-        st.markdown(clean_and_format_response(response))
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        # Get AI response
+        with st.chat_message("assistant"):
+            reply = stream_reply(deltas)
+            st.session_state.messages.append(reply)
+    finally:
+        # Also if a rerun interrupts while the bubbles are drawn, before the answer is read
+        deltas.close()